@@ -0,0 +1,285 @@
+"""
+analytics.py - 每日记录的历史统计
+
+把状态库中所有目标的每日记录 (全场最佳、击杀数、段位、自由战局数) 一次载入为
+目标 × 日期 的列式数组 (numpy)，整批计算:
+- 每日击杀增量 (击杀数为累计值，按前一个有记录的日期求差)
+- 段位变化
+- 滑动平均
+- 按局数 / 击杀增量 / 段位提升的前 N 名排行
+
+数组可以缓存为 .npy 文件并以内存映射方式打开，数百个目标 × 数年的数据也无需逐行处理。
+依赖 numpy (可选依赖，只有本模块需要): pip install numpy
+
+用法:
+    python analytics.py --since 2026-10-01 --top 10
+    python analytics.py --metric kills --window 7 --cache
+"""
+
+import os, sys, json, argparse, datetime
+
+try:
+    import numpy as np
+except ImportError:
+    print("analytics.py 需要 numpy，请先执行: pip install numpy")
+    raise
+
+from state_store import get_store, DATA_DIR
+
+# ================= 配置区域 =================
+CACHE_DIR = os.path.join(DATA_DIR, 'analytics_cache')
+# 数值列 (与 SqliteStore.daily_record_values 的返回顺序一致)
+VALUE_COLUMNS = ('best_overall', 'kill_count', 'grade', 'daily_count')
+# 排行可选的指标
+RANKINGS = {
+    "games": "自由战局数",
+    "kills": "击杀增量",
+    "grade": "段位提升",
+    "best": "全场最佳增量",
+}
+
+class DailyColumns:
+    """
+    目标 × 日期 的列式每日记录
+
+    targets 为目标 ID 数组 (T,)，dates 为连续日期数组 (D,)，
+    VALUE_COLUMNS 中每一列都是 (T, D) 的 float64 矩阵，没有记录的日期为 NaN。
+    baseline 为各列在第一天之前最后一个有效值 (T,)，用于计算窗口第一天的增量；没有更早记录时为 NaN。
+    """
+    def __init__(self, targets, start, columns, baseline=None):
+        self.targets = np.asarray(targets)
+        self.columns = columns
+        days = next(iter(columns.values())).shape[1] if columns else 0
+        self.dates = np.datetime64(start, 'D') + np.arange(days)
+        if baseline is None:
+            baseline = {name: np.full(len(self.targets), np.nan) for name in columns}
+        self.baseline = baseline
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def from_store(cls, store=None, start=None, end=None):
+        """从状态库载入 (一次查询，按列整体填充)；指定 start 时另查各目标 start 之前最后一天的记录作为 baseline"""
+        store = store or get_store()
+        rows = store.daily_record_values(start, end)
+        if not rows:
+            return cls([], start or datetime.date.today().isoformat(), {name: np.empty((0, 0)) for name in VALUE_COLUMNS})
+
+        target_col, date_col, *value_cols = zip(*rows)
+        targets, target_index = np.unique(np.array(target_col), return_inverse=True)
+        dates = np.array(date_col, dtype='datetime64[D]')
+        first = dates.min()
+        day_index = (dates - first).astype(np.int64)
+        days = int(day_index.max()) + 1
+
+        columns = {}
+        for name, values in zip(VALUE_COLUMNS, value_cols):
+            matrix = np.full((len(targets), days), np.nan)
+            matrix[target_index, day_index] = np.array(values, dtype=np.float64)
+            columns[name] = matrix
+
+        baseline = {name: np.full(len(targets), np.nan) for name in VALUE_COLUMNS}
+        if start:
+            position = {target: i for i, target in enumerate(targets.tolist())}
+            for target_id, _, *values in store.daily_record_baseline(start):
+                i = position.get(target_id)
+                if i is None:
+                    continue
+                for name, value in zip(VALUE_COLUMNS, values):
+                    if value is not None:
+                        baseline[name][i] = value
+        return cls(targets, first, columns, baseline)
+
+    # ---------- 缓存 ----------
+    def save(self, directory=CACHE_DIR):
+        """保存为 .npy 文件 + meta.json，之后可用 load(mmap=True) 按需读取"""
+        os.makedirs(directory, exist_ok=True)
+        for name, matrix in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), matrix)
+        meta = {"targets": self.targets.tolist(), "start": str(self.dates[0]) if len(self.dates) else None,
+                "baseline": {name: [None if np.isnan(v) else float(v) for v in values] for name, values in self.baseline.items()}}
+        with open(os.path.join(directory, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory=CACHE_DIR, mmap=True):
+        """读取缓存；mmap 为 True 时以只读内存映射打开，不会整体读入内存"""
+        with open(os.path.join(directory, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                   for name in VALUE_COLUMNS}
+        baseline = {name: np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+                    for name, values in meta.get("baseline", {}).items()} or None
+        return cls(meta["targets"], meta["start"] or datetime.date.today().isoformat(), columns, baseline)
+
+    def window(self, start=None, end=None):
+        """按日期截取 (含两端)，返回新的 DailyColumns (共享底层数组)；截掉部分的最后一个有效值成为新的 baseline"""
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(start, 'D')))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right'))
+        start_date = self.dates[lo] if lo < len(self.dates) else np.datetime64(start or datetime.date.today(), 'D')
+        baseline = {}
+        for name, m in self.columns.items():
+            before = np.hstack([self.baseline[name][:, None], m[:, :lo]])
+            baseline[name] = forward_fill(before)[:, -1]
+        return DailyColumns(self.targets, start_date, {name: m[:, lo:hi] for name, m in self.columns.items()}, baseline)
+
+# ================= 向量化计算 =================
+def forward_fill(matrix):
+    """沿日期方向用前一个有效值填充 NaN (开头的 NaN 保持不变)"""
+    if matrix.size == 0:
+        return np.array(matrix, dtype=np.float64)
+    valid = ~np.isnan(matrix)
+    index = np.where(valid, np.arange(matrix.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return matrix[np.arange(matrix.shape[0])[:, None], index]
+
+def daily_deltas(matrix, baseline=None):
+    """
+    累计值的每日增量：当天有记录时为 当天值 - 之前最近一次记录的值，否则为 NaN
+
+    baseline (T,) 为第一天之前最后一次记录的值，第一天的增量以它为基准 (为 None 或 NaN 时第一天没有增量)。
+    增量为负 (数据被重置) 时记为 NaN。
+    """
+    if matrix.shape[1] == 0:
+        return np.array(matrix, dtype=np.float64)
+    seeded = np.hstack([np.full((matrix.shape[0], 1), np.nan) if baseline is None else np.asarray(baseline, dtype=np.float64)[:, None],
+                        matrix])
+    previous = forward_fill(seeded)[:, :-1]
+    deltas = matrix - previous
+    deltas[deltas < 0] = np.nan
+    return deltas
+
+def kill_deltas(cols):
+    """每日击杀增量 (T, D)"""
+    return daily_deltas(cols['kill_count'], cols.baseline['kill_count'])
+
+def grade_progression(cols):
+    """
+    各目标在区间内的段位变化
+
+    首个段位优先取 baseline (区间开始前最后一次记录)，区间第一天的段位变化也计算在内。
+
+    Returns:
+        tuple: (首个段位, 最后段位, 变化量)，均为 (T,) 数组，没有记录的目标为 NaN
+    """
+    grades = cols['grade']
+    if grades.shape[1] == 0:
+        empty = np.full(grades.shape[0], np.nan)
+        return empty, empty.copy(), empty.copy()
+    last = forward_fill(grades)[:, -1]
+    first = forward_fill(grades[:, ::-1])[:, -1]
+    baseline = cols.baseline['grade']
+    first = np.where(np.isnan(baseline) | np.isnan(last), first, baseline)
+    return first, last, last - first
+
+def rolling_mean(matrix, window):
+    """忽略 NaN 的滑动平均 (窗口内没有任何记录时为 NaN)"""
+    values = np.nan_to_num(matrix, nan=0.0)
+    counts = (~np.isnan(matrix)).astype(np.float64)
+    pad = np.zeros((matrix.shape[0], 1))
+    value_sums = np.cumsum(np.hstack([pad, values]), axis=1)
+    count_sums = np.cumsum(np.hstack([pad, counts]), axis=1)
+    lagged = np.maximum(np.arange(1, matrix.shape[1] + 1) - window, 0)
+    total = value_sums[:, 1:] - value_sums[:, lagged]
+    count = count_sums[:, 1:] - count_sums[:, lagged]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+def top_n(scores, n):
+    """按分数从高到低取前 n 个 (忽略 NaN)，返回下标数组"""
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(scores))
+    order = valid[np.argsort(-scores[valid], kind='stable')]
+    return order[:n]
+
+def metric_scores(cols, metric):
+    """各目标在区间内某项指标的总量 (T,)"""
+    if metric == "games":
+        values = cols['daily_count']
+    elif metric == "kills":
+        values = kill_deltas(cols)
+    elif metric == "best":
+        values = daily_deltas(cols['best_overall'], cols.baseline['best_overall'])
+    elif metric == "grade":
+        return grade_progression(cols)[2]
+    else:
+        raise ValueError(f"未知指标: {metric}")
+    has_data = (~np.isnan(values)).any(axis=1)
+    return np.where(has_data, np.nansum(values, axis=1), np.nan)
+
+def summarize(cols, window=7):
+    """
+    一次计算所有目标的汇总指标
+
+    Returns:
+        dict: 指标名 -> (T,) 数组，另含 "rolling_games" (最近 window 天的平均局数)
+    """
+    result = {metric: metric_scores(cols, metric) for metric in RANKINGS}
+    games = cols['daily_count']
+    result["rolling_games"] = rolling_mean(games, window)[:, -1] if games.shape[1] else np.full(games.shape[0], np.nan)
+    result["active_days"] = (np.nan_to_num(games) > 0).sum(axis=1)
+    return result
+
+# ================= 命令行 =================
+def load_target_names():
+    """从 config.json 读取目标 ID 对应的备注名 (读取失败时返回空字典)"""
+    from auth_manager import CONFIG_FILE
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except Exception:
+        return {}
+    names = {}
+    for account in config.get('accounts', []):
+        for target in account.get('targets', []):
+            if target.get('id') and target.get('name'):
+                names[str(target['id'])] = target['name']
+    return names
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="蛇蛇争霸每日记录统计")
+    parser.add_argument("--since", default=None, help="起始日期 YYYY-MM-DD，默认本月 1 日")
+    parser.add_argument("--until", default=None, help="结束日期 YYYY-MM-DD (含)，默认不限")
+    parser.add_argument("--metric", choices=sorted(RANKINGS), default="games", help="排行指标")
+    parser.add_argument("--top", type=int, default=10, help="排行人数")
+    parser.add_argument("--window", type=int, default=7, help="滑动平均的天数")
+    parser.add_argument("--cache", action="store_true", help="重新生成 analytics_cache/ 下的 .npy 缓存后再统计")
+    parser.add_argument("--from-cache", action="store_true", help="直接以内存映射方式读取已有缓存，不查询状态库")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    since = args.since or datetime.date.today().replace(day=1).isoformat()
+
+    if args.from_cache:
+        cols = DailyColumns.load().window(since, args.until)
+    else:
+        if args.cache:
+            full = DailyColumns.from_store()
+            full.save()
+            print(f"已更新缓存: {CACHE_DIR}")
+            cols = full.window(since, args.until)
+        else:
+            cols = DailyColumns.from_store(start=since, end=args.until)
+
+    if not len(cols.targets) or not len(cols.dates):
+        print("该时间段内没有每日记录。")
+        return
+
+    summary = summarize(cols, args.window)
+    names = load_target_names()
+    scores = summary[args.metric]
+    print(f"{since} ~ {args.until or str(cols.dates[-1])}，共 {len(cols.targets)} 个目标，{len(cols.dates)} 天")
+    print(f"按{RANKINGS[args.metric]}排行 (前 {args.top} 名):")
+    print(f"{'名次':<4}{'目标':<20}{RANKINGS[args.metric]:>10}{'局数':>8}{'击杀增量':>10}{'段位提升':>10}{f'近{args.window}日均局':>12}{'活跃天数':>10}")
+    for rank, i in enumerate(top_n(scores, args.top), 1):
+        target = str(cols.targets[i])
+        label = f"{names.get(target, '')}({target})" if target in names else target
+        row = [summary[key][i] for key in (args.metric, "games", "kills", "grade", "rolling_games")]
+        cells = "".join(f"{'-' if np.isnan(v) else f'{v:.0f}':>{w}}" for v, w in zip(row[:4], (10, 8, 10, 10)))
+        rolling = '-' if np.isnan(row[4]) else f"{row[4]:.2f}"
+        print(f"{rank:<4}{label:<20}{cells}{rolling:>12}{summary['active_days'][i]:>10}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
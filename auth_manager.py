@@ -5,10 +5,35 @@ auth_manager.py - 通用认证管理模块
 - 配置文件的加载和保存
 - 登录函数 (自动刷新 authKey)
 - 通用请求函数 (支持 -73 错误自动重试)
+- 连接池传输层 (keep-alive 复用连接, 可替换)
+- 异步执行引擎 (每日任务的多账号有限并发；监控不经过它，每轮在线程池中执行合并后的拉取)
+- authKey 有效期跟踪与提前刷新
+- 单飞登录 (同一账号并发 -73 只登录一次)
+- 请求编解码 (缓存各账号预编码的基础字段)
 - 异常通知机制
 """
 
-import requests, json, datetime, os, urllib.parse, sys
+import requests, json, os, urllib.parse, atexit, asyncio, threading, functools, contextlib, time, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from state_store import get_store
+from notifier import get_outbox
+from metrics import METRICS
+from profiler import PROFILER
+from ratelimit import AdaptiveLimiter, NullLimiter
+from latency import LatencyTracker, Hedger, HEDGE_SAFE_MSG_IDS
+from resilience import RetryPolicy, BreakerBoard
+
+try:
+    import orjson  # 可选: 更快的响应解析
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # ================= 配置区域 =================
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -25,58 +50,193 @@ HEADERS = {
 # 配置缓存
 _CONFIG_CACHE = None
 
+# 登录后会变化、需要在进程间同步的账号字段
+CREDENTIAL_FIELDS = ("authKey", "roleID", "accountName")
+# 检查配置文件是否被其他进程更新的最小间隔 (秒)
+CREDENTIAL_CHECK_INTERVAL = 1.0
+_CONFIG_VERSION = None
+_LAST_CREDENTIAL_CHECK = 0.0
+
+# 保护配置缓存的写入 (多账号并发登录时避免同时写文件)
+_CONFIG_LOCK = threading.RLock()
+
+# 全局传输层实例 (惰性创建, 两个入口脚本共享)
+_TRANSPORT = None
+# 全局限速器 (惰性创建)
+_LIMITER = None
+# 全局耗时统计与对冲执行器 (惰性创建)
+_LATENCY = None
+_HEDGER = None
+# 全局重试策略与熔断器表 (惰性创建)
+_RETRY_POLICY = None
+_BREAKERS = None
+
 class FatalAuthError(Exception):
     """严重认证错误，无法恢复，需要跳过当前账号"""
     pass
 
 # ================= 通知功能 =================
-def send_notification(title, content):
-    """通过青龙面板发送通知，如果不可用则打印"""
-    print(f"正在发送通知: {title}", end=' ')
-    try:
-        # 尝试访问全局注入的 QLAPI (青龙环境)
-        # if 'QLAPI' in globals():
-            print(QLAPI.systemNotify({"title": title, "content": content}))
-            return
-        
-    except Exception as e:
-        # 尝试访问 builtins 中的 QLAPI
-        import builtins
-        if hasattr(builtins, 'QLAPI'):
-            print(builtins.QLAPI.systemNotify({"title": title, "content": content}))
-            return
-        print(f"尝试发送通知失败: {e}")
+def send_notification(title, content, recipient="default"):
+    """
+    把通知放入发件箱后立即返回，由后台线程合并、限速后推送 (见 notifier.py)
     
-    # 默认回退：打印到控制台
-    print(f"\n[NOTIFICATION] {title}\n{content}\n")
+    发件箱参数读取 settings 中的 notify_* 项，首次发送通知时创建。
+    """
+    outbox = get_outbox(
+        maxsize=get_setting("notify_queue_size", 1000),
+        coalesce_window=get_setting("notify_coalesce_window", 2.0),
+        rate=get_setting("notify_rate", 1.0),
+        burst=get_setting("notify_burst", 5),
+        flush_timeout=get_setting("notify_flush_timeout", 30),
+    )
+    with PROFILER.span("notify"):
+        outbox.put(title, content, recipient)
 
 # ================= 配置管理 =================
+def _config_file_version():
+    """配置文件的版本标识 (mtime, size)，文件不存在时为 None"""
+    try:
+        st = os.stat(CONFIG_FILE)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _read_config_file():
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_config_file(config):
+    """先写临时文件再 rename，其他进程不会读到写了一半的配置"""
+    tmp_file = f"{CONFIG_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, CONFIG_FILE)
+
+@contextlib.contextmanager
+def config_file_lock():
+    """配置文件的互斥锁: 线程间用 _CONFIG_LOCK，进程间锁定 config.json.lock"""
+    with _CONFIG_LOCK, open(CONFIG_FILE + '.lock', 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def account_key(account):
+    """跨进程识别同一账号的键 (openID 不随登录变化，优先使用)"""
+    return account.get("openID") or account.get("note") or account.get("roleID")
+
+def _merge_credentials(source, skip=()):
+    """
+    把 source 配置中的账号凭据合并进内存中的同一账号
+    
+    Returns:
+        bool: 是否有账号的凭据发生变化
+    """
+    changed = False
+    source_accounts = {account_key(a): a for a in source.get("accounts", [])}
+    for account in _CONFIG_CACHE.get("accounts", []):
+        key = account_key(account)
+        if key in skip or key not in source_accounts:
+            continue
+        for field in CREDENTIAL_FIELDS:
+            value = source_accounts[key].get(field)
+            if value is not None and account.get(field) != value:
+                account[field] = value
+                changed = True
+    return changed
+
 def load_config():
     """加载配置文件，返回配置字典并缓存"""
-    global _CONFIG_CACHE
+    global _CONFIG_CACHE, _CONFIG_VERSION
     if not os.path.exists(CONFIG_FILE):
         print(f"错误: 配置文件未找到 {CONFIG_FILE}")
         return None
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            _CONFIG_CACHE = json.load(f)
-            return _CONFIG_CACHE
+        version = _config_file_version()
+        _CONFIG_CACHE = _read_config_file()
+        _CONFIG_VERSION = version
+        return _CONFIG_CACHE
     except Exception as e:
         print(f"错误: 读取配置文件失败 {e}")
         return None
 
-def save_config():
-    """保存当前缓存的配置到文件"""
-    global _CONFIG_CACHE
+def save_config(accounts=None):
+    """
+    把账号凭据合并写回配置文件
+    
+    持有跨进程锁后重新读取磁盘上的配置，只覆盖 accounts 中各账号的凭据字段，
+    其余内容 (包括其他进程刚刷新的账号) 以磁盘为准，再原子替换文件。
+    
+    Args:
+        accounts: 需要写回的账号列表，默认为缓存中的全部账号
+    """
+    global _CONFIG_VERSION
     if _CONFIG_CACHE is None:
         return
+    if accounts is None:
+        accounts = _CONFIG_CACHE.get("accounts", [])
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(_CONFIG_CACHE, f, ensure_ascii=False, indent=2)
+        with config_file_lock():
+            try:
+                on_disk = _read_config_file()
+            except (OSError, ValueError):
+                on_disk = _CONFIG_CACHE
+            disk_accounts = {account_key(a): a for a in on_disk.get("accounts", [])}
+            for account in accounts:
+                target = disk_accounts.get(account_key(account))
+                if target is not None and target is not account:
+                    target.update({field: account[field] for field in CREDENTIAL_FIELDS if field in account})
+            # 顺便吸收其他进程写入的凭据
+            _merge_credentials(on_disk, skip={account_key(a) for a in accounts})
+            _write_config_file(on_disk)
+            _CONFIG_VERSION = _config_file_version()
         print("配置文件已保存。")
     except Exception as e:
         print(f"错误: 保存配置文件失败 {e}")
 
+def refresh_credentials(force=False):
+    """
+    检查配置文件是否被其他进程更新 (mtime/size)，是则把新的凭据合并进内存中的账号
+    
+    Args:
+        force: 忽略 CREDENTIAL_CHECK_INTERVAL 节流，立即检查
+    
+    Returns:
+        bool: 是否有账号的凭据发生变化
+    """
+    global _CONFIG_VERSION, _LAST_CREDENTIAL_CHECK
+    if _CONFIG_CACHE is None:
+        return False
+    now = time.monotonic()
+    if not force and now - _LAST_CREDENTIAL_CHECK < CREDENTIAL_CHECK_INTERVAL:
+        return False
+    _LAST_CREDENTIAL_CHECK = now
+    version = _config_file_version()
+    if version is None or version == _CONFIG_VERSION:
+        return False
+    try:
+        on_disk = _read_config_file()
+    except (OSError, ValueError):
+        return False
+    with _CONFIG_LOCK:
+        _CONFIG_VERSION = version
+        changed = _merge_credentials(on_disk)
+    if changed:
+        print("检测到其他进程更新了账号凭据，已同步。")
+        with _AUTH_META_LOCK:
+            _AUTH_META.clear()  # 签发时间由对方写入状态库，重新读取
+    return changed
+
 def get_config_cache():
     """获取配置缓存的引用"""
     global _CONFIG_CACHE
@@ -91,6 +251,301 @@ def get_common_param(key, default=None):
         return config["common"].get(key, default)
     return default
 
+def get_setting(key, default=None):
+    """从配置文件的 settings 节点获取运行参数 (连接池大小等)"""
+    config = get_config_cache()
+    if config and "settings" in config:
+        return config["settings"].get(key, default)
+    return default
+
+# ================= 传输层 =================
+class Transport:
+    """
+    基于 requests.Session 的连接池传输层
+    
+    同一主机的请求复用 keep-alive 连接，避免每个 msg_id 都重新握手。
+    任何实现了 post(body, timeout) 并返回带 status_code / json() (可选 content) 的对象
+    都可以通过 set_transport 替换它 (例如测试用的本地替身)。
+    """
+    def __init__(self, base_url=BASE_URL, headers=HEADERS, pool_connections=4, pool_maxsize=16, pool_block=False):
+        """
+        Args:
+            base_url: 请求地址
+            headers: 默认请求头
+            pool_connections: 缓存的主机连接池数量
+            pool_maxsize: 每个主机连接池保留的最大连接数
+            pool_block: 连接池满时是否阻塞等待 (True 时严格限制单主机并发连接数)
+        """
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, body, timeout=15):
+        """发送表单请求体，返回 requests.Response"""
+        return self.session.post(self.base_url, data=body, timeout=timeout)
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+def get_transport():
+    """获取全局传输层，首次调用时按 settings 节点创建连接池"""
+    global _TRANSPORT
+    if _TRANSPORT is None:
+        with _CONFIG_LOCK:
+            if _TRANSPORT is None:
+                _TRANSPORT = Transport(
+                    pool_connections=get_setting("pool_connections", 4),
+                    pool_maxsize=get_setting("pool_maxsize", 16),
+                    pool_block=get_setting("pool_block", False)
+                )
+    return _TRANSPORT
+
+def set_transport(transport):
+    """
+    替换全局传输层
+    
+    Args:
+        transport: 新的传输层实例，传 None 则下次使用时按配置重新创建
+    
+    Returns:
+        旧的传输层实例 (可能为 None)，调用方负责关闭
+    """
+    global _TRANSPORT
+    with _CONFIG_LOCK:
+        old, _TRANSPORT = _TRANSPORT, transport
+    return old
+
+@atexit.register
+def _close_transport():
+    if _TRANSPORT is not None and hasattr(_TRANSPORT, "close"):
+        _TRANSPORT.close()
+
+# ================= 限速 =================
+def get_limiter():
+    """获取全局限速器，首次调用时按 settings 节点创建；settings.rate_limit 为 false 时不限速"""
+    global _LIMITER
+    if _LIMITER is None:
+        if not get_setting("rate_limit", True):
+            _LIMITER = NullLimiter()
+        else:
+            _LIMITER = AdaptiveLimiter(
+                initial_rate=get_setting("rate_initial", 10.0),
+                min_rate=get_setting("rate_min", 0.5),
+                max_rate=get_setting("rate_max", 50.0),
+                budgets=get_setting("rate_budgets", {}),
+                concurrency=get_setting("concurrency", 8),
+                max_concurrency=get_setting("rate_max_concurrency", 64),
+                latency_target=get_setting("rate_latency_target", 2.0),
+            )
+    return _LIMITER
+
+def set_limiter(limiter):
+    """替换全局限速器 (传 None 则下次使用时按配置重新创建)，返回旧的限速器"""
+    global _LIMITER
+    old, _LIMITER = _LIMITER, limiter
+    return old
+
+# ================= 自适应超时与对冲 =================
+def get_latency_tracker():
+    """获取全局耗时统计，首次调用时按 settings 节点创建；settings.adaptive_timeout 为 false 时超时固定为 timeout_max"""
+    global _LATENCY
+    if _LATENCY is None:
+        max_timeout = get_setting("timeout_max", 15.0)
+        _LATENCY = LatencyTracker(
+            window=get_setting("latency_window", 200),
+            timeout_percentile=get_setting("timeout_percentile", 0.99),
+            multiplier=get_setting("timeout_multiplier", 3.0),
+            min_timeout=get_setting("timeout_min", 3.0) if get_setting("adaptive_timeout", True) else max_timeout,
+            max_timeout=max_timeout,
+        )
+    return _LATENCY
+
+def get_hedger():
+    """获取全局对冲执行器，settings.hedge_requests 为 false 时返回 None"""
+    global _HEDGER
+    if _HEDGER is None and get_setting("hedge_requests", True):
+        with _CONFIG_LOCK:
+            if _HEDGER is None:
+                _HEDGER = Hedger(max_workers=2 * get_setting("rate_max_concurrency", 64),
+                                 budget=get_setting("hedge_budget", 0.1))
+    return _HEDGER
+
+@atexit.register
+def _shutdown_hedger():
+    if _HEDGER is not None:
+        _HEDGER.shutdown()
+
+def _post(msg_id, body):
+    """
+    发送请求体：超时取该 msg_id 最近耗时的分位数，
+    只读请求 (HEDGE_SAFE_MSG_IDS) 超过 p95 仍未返回时再发一份，取先返回的结果；
+    对冲请求同样占用限速器的令牌和并发名额，限速器已饱和时不对冲
+    """
+    tracker = get_latency_tracker()
+    timeout = tracker.timeout(msg_id)
+
+    def attempt():
+        started = time.perf_counter()
+        try:
+            response = get_transport().post(body, timeout=timeout)
+        except requests.Timeout:
+            tracker.record(msg_id, timeout)
+            raise
+        tracker.record(msg_id, time.perf_counter() - started)
+        return response
+
+    hedger = get_hedger() if msg_id in HEDGE_SAFE_MSG_IDS else None
+    delay = tracker.hedge_delay(msg_id) if hedger else None
+    if delay is None:
+        return attempt()
+
+    limiter = get_limiter()
+    slots = []
+
+    def admit():
+        call = limiter.try_acquire(msg_id)
+        if call is None:
+            return False
+        slots.append(call)
+        return True
+
+    def backup():
+        call = slots[0]
+        try:
+            response = attempt()
+            call.observe(response.status_code)
+            return response
+        finally:
+            limiter.release(msg_id, call)
+
+    response, winner = hedger.call(attempt, delay, backup, admit)
+    if winner:
+        METRICS.inc("sszb_hedged_requests_total", msg_id=msg_id, winner=winner)
+    return response
+
+# ================= 重试与熔断 =================
+def get_retry_policy():
+    """获取全局重试策略，首次调用时按 settings 节点创建"""
+    global _RETRY_POLICY
+    if _RETRY_POLICY is None:
+        _RETRY_POLICY = RetryPolicy(retries=get_setting("retry_attempts", 2),
+                                    base_delay=get_setting("retry_base_delay", 0.5),
+                                    max_delay=get_setting("retry_max_delay", 8.0))
+    return _RETRY_POLICY
+
+def get_breakers():
+    """获取全局熔断器表，首次调用时按 settings 节点创建 (账号熔断状态保存在状态库)"""
+    global _BREAKERS
+    if _BREAKERS is None:
+        with _CONFIG_LOCK:
+            if _BREAKERS is None:
+                _BREAKERS = BreakerBoard(get_store(),
+                                         failure_threshold=get_setting("breaker_failure_threshold", 5),
+                                         reset_timeout=get_setting("breaker_reset_timeout", 60),
+                                         max_reset_timeout=get_setting("breaker_max_reset_timeout", 3600))
+    return _BREAKERS
+
+def _credential_fingerprint(account):
+    return hashlib.md5(f"{account.get('openKey', '')}|{account.get('authKey', '')}".encode('utf-8')).hexdigest()[:12]
+
+def _account_breaker(account):
+    """
+    账号的熔断器；因认证失败打开后，若 config.json 中的凭据已被更新 (重新抓包)，立即关闭
+    """
+    breaker = get_breakers().account(account_key(account))
+    if breaker.state != "closed" and breaker.fingerprint and breaker.fingerprint != _credential_fingerprint(account):
+        print(f"[{account.get('note', '未知账号')}] 凭据已更新，解除账号熔断。")
+        breaker.reset()
+    return breaker
+
+def _record_failure(account_breaker, endpoint_breaker, note, msg_id):
+    """重试后仍失败：登记到账号与接口的熔断器，打开时提示"""
+    for scope, breaker, label in (("account", account_breaker, f"账号 [{note}]"), ("endpoint", endpoint_breaker, f"接口 {msg_id}")):
+        if breaker.record_failure():
+            METRICS.inc("sszb_breaker_trips_total", scope=scope)
+            print(f"{label} 连续失败，熔断 {breaker.reset_timeout:.0f} 秒。")
+
+def _trip_auth_breaker(account):
+    """认证失败 (静默) 的账号打开熔断器，等待 auth_breaker_timeout 秒后才会再发探测请求，探测仍失败则翻倍"""
+    breaker = _account_breaker(account)
+    if breaker.trip(get_setting("auth_breaker_timeout", 3600), _credential_fingerprint(account),
+                    get_setting("auth_breaker_max_timeout", 86400)):
+        METRICS.inc("sszb_breaker_trips_total", scope="auth")
+        print(f"[{account.get('note', '未知账号')}] 账号熔断 {breaker.reset_timeout:.0f} 秒，期间不再发送请求。")
+
+def _response_code(res):
+    """响应中的错误码 (部分接口使用 errCode)"""
+    if not res:
+        return None
+    return res.get("errorCode", res.get("errCode"))
+
+# ================= 请求编解码 =================
+class RequestCodec:
+    """
+    请求体编码与响应解码
+    
+    每个账号的基础字段 (get_base_msg 的内容) 只在凭据或公共参数变化时编码一次，
+    缓存为 URL 编码后的 JSON 前缀；每次请求只编码附加字段再拼接。
+    URL 编码逐字符进行，因此拼接结果与整体 json.dumps + quote 完全一致。
+    """
+    def __init__(self):
+        self._cache = {}  # account_key -> (凭据标识, 基础字段字典, 编码后的前缀)
+        self._lock = threading.Lock()
+
+    def base(self, account):
+        """返回账号的 (基础字段字典, 编码后的 JSON 前缀)，凭据变化时自动重建"""
+        ident = (account.get("authKey"), account.get("accountName", ""), account.get("roleID", 0), id(_CONFIG_CACHE))
+        key = account_key(account)
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != ident:
+            base = {
+                "authKey": account.get("authKey"),
+                "accountName": account.get("accountName", ""),
+                "roleID": int(account.get("roleID", 0)),
+                "pfID": get_common_param("pfID", 2),
+                "deviceID": get_common_param("deviceID", "b227a7c94278f2e9de046915c1d01c2f89dee3ba"),
+                "bundleIdentifier": get_common_param("bundleIdentifier", "com.bairimeng.snake.13"),
+                "version": get_common_param("version", "8.9.7")
+            }
+            prefix = urllib.parse.quote(json.dumps(base, ensure_ascii=False)[:-1])
+            entry = (ident, base, prefix)
+            with self._lock:
+                self._cache[key] = entry
+        return entry[1], entry[2]
+
+    def encode(self, msg_id, msg_data, account=None):
+        """
+        编码表单请求体 msg_id=...&msg=...
+        
+        msg_data 中的基础字段与账号缓存一致时走拼接路径，否则整体编码。
+        """
+        if account is not None:
+            base, prefix = self.base(account)
+            if all(msg_data.get(k, _MISSING) == v for k, v in base.items()):
+                extra = {k: v for k, v in msg_data.items() if k not in base}
+                tail = (", " + json.dumps(extra, ensure_ascii=False)[1:]) if extra else "}"
+                return f"msg_id={msg_id}&msg={prefix}{urllib.parse.quote(tail)}"
+        return f"msg_id={msg_id}&msg={urllib.parse.quote(json.dumps(msg_data, ensure_ascii=False))}"
+
+    @staticmethod
+    def decode(response):
+        """解析响应 JSON，安装了 orjson 时使用 orjson"""
+        content = getattr(response, "content", None)
+        if orjson is not None and content is not None:
+            return orjson.loads(content)
+        return response.json()
+
+_MISSING = object()
+_CODEC = RequestCodec()
+
+def get_codec():
+    """获取全局编解码器"""
+    return _CODEC
+
 # ================= 登录功能 =================
 def login(account):
     """
@@ -116,20 +571,26 @@ def login(account):
         "idfv": ""
     }
     
-    msg_json = json.dumps(msg_data, ensure_ascii=False)
-    encoded_msg = urllib.parse.quote(msg_json)
-    body = f"msg_id={msg_id}&msg={encoded_msg}"
+    body = _CODEC.encode(msg_id, msg_data)
+    METRICS.inc("sszb_login_attempts_total")
     
     try:
-        response = requests.post(BASE_URL, headers=HEADERS, data=body, timeout=15)
-        res = response.json() if response.status_code == 200 else None
+        started = time.perf_counter()
+        with PROFILER.span("login"), get_limiter().request(msg_id) as call:
+            response = _post(msg_id, body)
+            res = _CODEC.decode(response) if response.status_code == 200 else None
+            call.observe(response.status_code, _response_code(res))
+        _observe(msg_id, started, body, response, res)
         
         if res and res.get("errorCode") == 0:
+            METRICS.inc("sszb_login_success_total")
             print(f"登录成功: {res.get('accountName')} (RoleID: {res.get('roleID')})")
-            account["authKey"] = res.get("authKey")
-            account["roleID"] = str(res.get("roleID"))
-            account["accountName"] = res.get("accountName")
-            save_config()  # 立即持久化重要认证参数
+            with _CONFIG_LOCK:
+                account["authKey"] = res.get("authKey")
+                account["roleID"] = str(res.get("roleID"))
+                account["accountName"] = res.get("accountName")
+                save_config([account])  # 立即持久化重要认证参数 (与其他进程的改动合并)
+            record_login(account, res.get("serverTimeStamp"))
             return True
         else:
             error_msg = res.get('errorMsg', 'HTTP错误或解析失败') if res else 'HTTP错误'
@@ -139,6 +600,183 @@ def login(account):
         print(f"登录异常: {e}")
         return False
 
+# ================= 单飞登录 =================
+_LOGIN_LOCKS = {}  # account_key -> (线程锁, 已完成的登录次数, 最近一次登录结果)
+_LOGIN_LOCKS_GUARD = threading.Lock()
+
+def _login_slot(account):
+    with _LOGIN_LOCKS_GUARD:
+        return _LOGIN_LOCKS.setdefault(account_key(account), {"lock": threading.Lock(), "generation": 0, "result": False})
+
+@contextlib.contextmanager
+def _login_file_lock(account):
+    """同一账号的跨进程登录锁 (config.json 同目录下的 .login_lock_{hash})"""
+    digest = hashlib.md5(str(account_key(account)).encode('utf-8')).hexdigest()[:12]
+    lock_file = os.path.join(os.path.dirname(CONFIG_FILE), f'.login_lock_{digest}')
+    with open(lock_file, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def login_once(account, stale_key=None, expired=False):
+    """
+    单飞登录：同一账号同一时刻只有一个调用者真正执行 login，其余等待并复用其结果
+    
+    线程和 asyncio 任务 (在线程池中执行) 由进程内的锁合并；其他进程由文件锁合并，
+    拿到锁后会先同步配置文件，若 authKey 已被别人刷新则不再登录。
+    
+    Args:
+        account: 账号配置字典
+        stale_key: 调用方确认已失效的 authKey；账号当前的 authKey 与之不同时视为已刷新
+        expired: 是否因 -73 触发，是则真正登录前打印并发送认证过期通知
+    
+    Returns:
+        bool: 账号现在是否持有可用的新 authKey
+    """
+    slot = _login_slot(account)
+    generation = slot["generation"]
+    with slot["lock"]:
+        # 等锁期间已有其他线程完成了登录，直接复用其结果
+        if slot["generation"] != generation:
+            return slot["result"]
+        with _login_file_lock(account):
+            refresh_credentials(force=True)
+            if stale_key is not None and account.get("authKey") != stale_key:
+                return True
+            if expired:
+                note = account.get('note', '未知账号')
+                print(f"账号:[{note}] 认证过期(-73)！发送通知并尝试自动登录...")
+                send_notification(f"蛇蛇争霸 - 账号认证失败", f"账号 [{note}] 认证已过期 (-73)，尝试重新登录...")
+            result = login(account)
+        slot["result"] = result
+        slot["generation"] += 1
+        return result
+
+# ================= 凭据有效期 =================
+# 每个账号最多保留的有效期观测数
+MAX_LIFETIME_SAMPLES = 10
+# 提前刷新失败后，同一账号再次尝试前的等待时间 (秒)
+REFRESH_RETRY_DELAY = 60
+
+_AUTH_META = {}  # account_key -> 有效期记录 (状态库的内存缓存)
+_AUTH_META_LOCK = threading.Lock()
+_REFRESH_ATTEMPTS = {}  # account_key -> 上次提前刷新的时间
+
+def _get_auth_meta(account):
+    key = account_key(account)
+    with _AUTH_META_LOCK:
+        if key not in _AUTH_META:
+            _AUTH_META[key] = get_store().load_auth_meta(key)
+        return _AUTH_META[key]
+
+def _save_auth_meta(account, meta):
+    with _AUTH_META_LOCK:
+        _AUTH_META[account_key(account)] = meta
+    try:
+        get_store().save_auth_meta(account_key(account), meta)
+    except Exception as e:
+        print(f"保存凭据有效期记录失败: {e}")
+
+def record_login(account, server_timestamp=None):
+    """登录成功后记录 authKey 的签发时间 (以 30001 响应的 serverTimeStamp 为准)"""
+    meta = dict(_get_auth_meta(account))
+    now = time.time()
+    meta["issued_at"] = server_timestamp or now
+    meta["clock_skew"] = (server_timestamp - now) if server_timestamp else 0.0
+    _save_auth_meta(account, meta)
+
+def record_auth_expiry(account):
+    """遇到 -73 时记录这把 authKey 实际存活的时长"""
+    meta = dict(_get_auth_meta(account))
+    if not meta.get("issued_at"):
+        return
+    lifetime = time.time() + meta.get("clock_skew", 0.0) - meta["issued_at"]
+    if lifetime > 0:
+        meta["lifetimes"] = (meta.get("lifetimes", []) + [round(lifetime)])[-MAX_LIFETIME_SAMPLES:]
+        meta["issued_at"] = None  # 这把 key 已失效，等待下次登录
+        _save_auth_meta(account, meta)
+
+def expected_lifetime(account):
+    """
+    预计的 authKey 有效期 (秒)
+    
+    取观测值的中位数 (在别处登录导致的偶发短寿命不会把估计拉得过低)，
+    且不低于 settings.auth_min_lifetime；没有观测值时以 settings.auth_key_ttl 为准，都没有则返回 None。
+    """
+    lifetimes = sorted(_get_auth_meta(account).get("lifetimes", []))
+    if lifetimes:
+        return max(lifetimes[len(lifetimes) // 2], get_setting("auth_min_lifetime", 600))
+    return get_setting("auth_key_ttl")
+
+def credential_age(account):
+    """当前 authKey 已使用的时长 (秒)，签发时间未知时返回 None"""
+    meta = _get_auth_meta(account)
+    if not meta.get("issued_at"):
+        return None
+    return time.time() + meta.get("clock_skew", 0.0) - meta["issued_at"]
+
+def credential_due(account):
+    """authKey 是否已接近预计的失效时间"""
+    age, lifetime = credential_age(account), expected_lifetime(account)
+    if age is None or not lifetime:
+        return False
+    return age >= lifetime * get_setting("auth_refresh_ratio", 0.8)
+
+def refresh_if_due(account):
+    """
+    authKey 接近失效时提前登录刷新，避免请求走 -73 → 登录 → 重试的慢路径
+    
+    Returns:
+        bool: 是否执行了刷新且成功
+    """
+    if not credential_due(account):
+        return False
+    if get_breakers().account(account_key(account)).state != "closed":
+        return False  # 熔断中的账号不主动登录
+    key = account_key(account)
+    now = time.monotonic()
+    with _AUTH_META_LOCK:
+        if now - _REFRESH_ATTEMPTS.get(key, -REFRESH_RETRY_DELAY) < REFRESH_RETRY_DELAY:
+            return False
+        _REFRESH_ATTEMPTS[key] = now
+    print(f"[{account.get('note', '未知账号')}] authKey 已使用 {credential_age(account):.0f} 秒 "
+          f"(预计有效期 {expected_lifetime(account):.0f} 秒)，提前刷新...")
+    return login_once(account, stale_key=account.get("authKey"))
+
+class AuthRefresher:
+    """后台线程：定期检查各账号的 authKey，在预计失效前刷新 (常驻模式使用)"""
+    def __init__(self, accounts, interval=None):
+        self.accounts = accounts
+        self.interval = interval or get_setting("auth_refresh_check_interval", 30)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="auth-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for account in self.accounts:
+                if self._stop.is_set():
+                    break
+                try:
+                    refresh_if_due(account)
+                except Exception as e:
+                    print(f"[{account.get('note', '未知账号')}] 提前刷新 authKey 出错: {e}")
+
 # ================= 通用请求 =================
 def make_request(msg_id, msg_data, account, retry_on_auth_fail=True):
     """
@@ -157,34 +795,69 @@ def make_request(msg_id, msg_data, account, retry_on_auth_fail=True):
     Raises:
         FatalAuthError: 当自动登录失败，无法恢复时抛出
     """
-    msg_json = json.dumps(msg_data, ensure_ascii=False)
-    encoded_msg = urllib.parse.quote(msg_json)
-    body = f"msg_id={msg_id}&msg={encoded_msg}"
+    # 其他进程 (监控/每日任务) 可能已经刷新了该账号的 authKey，请求前同步
+    refresh_credentials()
     note = account.get('note', '未知账号')
     roleID = account.get('roleID', 'unknown_id')
-    auth_failed_mark_file = os.path.join(os.path.dirname(__file__), f'.auth_failed_mark_{roleID}')
+    store = get_store()
+
+    # 熔断器打开期间直接短路，不发请求
+    account_breaker, endpoint_breaker = _account_breaker(account), get_breakers().endpoint(msg_id)
+    if not account_breaker.allow():
+        METRICS.inc("sszb_short_circuited_total", scope="account")
+        if store.is_auth_failed(roleID):
+            raise FatalAuthError(f"[{note}] 此前已认证失败，处于静默模式 ({account_breaker.retry_after():.0f} 秒后再尝试)。")
+        print(f"[{note}] 账号熔断中，跳过请求 {msg_id} ({account_breaker.retry_after():.0f} 秒后再尝试)")
+        return None
+    if not endpoint_breaker.allow():
+        METRICS.inc("sszb_short_circuited_total", scope="endpoint")
+        print(f"[{note}] 接口 {msg_id} 熔断中，跳过请求 ({endpoint_breaker.retry_after():.0f} 秒后再尝试)")
+        return None
+
+    # 本账号的 authKey 接近预计失效时间则先行刷新
+    if retry_on_auth_fail:
+        refresh_if_due(account)
+    if "authKey" in msg_data and msg_data["authKey"] != account.get("authKey"):
+        msg_data["authKey"] = account["authKey"]
+
+    body = _CODEC.encode(msg_id, msg_data, account)
     
     try:
-        response = requests.post(BASE_URL, headers=HEADERS, data=body, timeout=15)
+        try:
+            response, res = _send_with_retry(msg_id, body, note)
+        except Exception:
+            _record_failure(account_breaker, endpoint_breaker, note, msg_id)
+            raise
         if response.status_code != 200:
+            _record_failure(account_breaker, endpoint_breaker, note, msg_id)
             print(f"请求失败: HTTP {response.status_code}")
             return None
-        
-        res = response.json()
+
+        endpoint_breaker.record_success()
+        if res.get("errorCode") != -73:
+            account_breaker.record_success()
         
         # 处理认证失败 (-73)
         if res.get("errorCode") == -73 and retry_on_auth_fail:
+            # 先确认是否已被其他进程重新登录，是则直接用新的 authKey 重试
+            refresh_credentials(force=True)
+            if "authKey" in msg_data and msg_data["authKey"] != account.get("authKey"):
+                print(f"账号:[{note}] authKey 已被其他进程刷新，直接重试。")
+                msg_data["authKey"] = account["authKey"]
+                return make_request(msg_id, msg_data, account, retry_on_auth_fail=False)
+
+            record_auth_expiry(account)
+
             # 检查失败静默标记，若存在则跳过登录尝试，抛出致命错误
-            if os.path.exists(auth_failed_mark_file):
+            if store.is_auth_failed(roleID):
                 # err_msg = f"账号 [{note}] 此前已登录失败，跳过重试并停止执行后续！"
                 err_msg = f"[{note}] 此前已认证失败，处于静默模式。\n该账号后续任务已停止，请尽快手动重新抓包更新配置！"
                 print(f"[CRITICAL] {err_msg}")
+                _trip_auth_breaker(account)
                 raise FatalAuthError(err_msg)
 
-            print(f"账号:[{note}] 认证过期(-73)！发送通知并尝试自动登录...")
-            send_notification(f"蛇蛇争霸 - 账号认证失败", f"账号 [{note}] 认证已过期 (-73)，尝试重新登录...")
-            
-            if login(account): # 自动重新登录成功，更新请求数据中的 authKey 和 roleID 后重试
+            # 同一账号并发遇到 -73 时只有一个调用者真正登录 (并发送通知)，其余复用其结果
+            if login_once(account, stale_key=msg_data.get("authKey"), expired=True): # 自动重新登录成功，更新请求数据中的 authKey 和 roleID 后重试
                 msg_data["authKey"] = account["authKey"]
                 # if "roleID" in msg_data:
                 #     msg_data["roleID"] = int(account["roleID"])
@@ -192,38 +865,141 @@ def make_request(msg_id, msg_data, account, retry_on_auth_fail=True):
             else: # 自动登录失败，这是严重错误，必须推送通知人来解决
                 err_msg = f"账号 [{note}] 自动登录失败，无法更新authKey！\n可能原因: openKey过期或网络问题。\n该账号后续任务将停止，请尽快手动重新抓包更新配置！"
                 print(f"[CRITICAL] {err_msg}")
-                if not os.path.exists(auth_failed_mark_file): # 认证首次出错，发送通知并创建静默标记
+                if not store.is_auth_failed(roleID): # 认证首次出错，发送通知并创建静默标记
                     # msg = f"检测到关键错误 -73：账号认证失败 (authKey过期或在别处登录)。\n账号: {account_note}\n后续将停止通知直至恢复正常，请及时重新登录，抓包，更新authKey！"
                     send_notification("蛇蛇争霸 - 账号认证失败", err_msg)
                     try:
-                        with open(auth_failed_mark_file, 'w', encoding='utf-8') as f:
-                            f.write(f"Auth failed at: {datetime.datetime.now().isoformat()}")
+                        store.mark_auth_failed(roleID, note)
                     except Exception as e:
                         print(f"创建静默标记失败: {e}")
-                            
+                _trip_auth_breaker(account)
                 raise FatalAuthError(err_msg)
 
         # 如果请求成功 (0)，清除可能存在的失败标记 (针对非-73但偶尔恢复的情况，或重试成功的情况)
-        if res.get("errorCode")==0 and os.path.exists(auth_failed_mark_file):
-            os.remove(auth_failed_mark_file)
+        if res.get("errorCode")==0 and store.is_auth_failed(roleID) and store.clear_auth_failed(roleID):
             msg = f"账号 [{note}] 请求成功，已清除静默失败标记。"
             print(msg)
             send_notification(f"蛇蛇争霸 - 账号 [{note}] 认证恢复正常", msg)
         return res
     except FatalAuthError:
-        raise FatalAuthError
+        raise
     except Exception as e:
         print(f"请求异常: {e}")
         return None
 
+def _send(msg_id, body):
+    """发送一次请求 (经过限速器)，返回 (response, 解析后的响应)；非 200 时响应为 None"""
+    # 限速器按本次的耗时、状态码和错误码调整该 msg_id 的速率与全局并发窗口
+    with get_limiter().request(msg_id) as call:
+        started = time.perf_counter()
+        with PROFILER.span("fetch"):
+            response = _post(msg_id, body)
+        res = None
+        if response.status_code == 200:
+            with PROFILER.span("decode"):
+                res = _CODEC.decode(response)
+        call.observe(response.status_code, _response_code(res))
+    _observe(msg_id, started, body, response, res)
+    return response, res
+
+def _send_with_retry(msg_id, body, note):
+    """
+    发送请求，暂时性失败 (网络异常、HTTP 429/5xx) 按 RetryPolicy 退避重试
+
+    最后一次仍然失败时抛出异常或返回非 200 的响应，由调用方处理。
+    """
+    policy = get_retry_policy()
+    attempt = 0
+    while True:
+        try:
+            response, res = _send(msg_id, body)
+            if response.status_code == 200 or not policy.should_retry(msg_id, attempt, status=response.status_code):
+                return response, res
+            reason = f"HTTP {response.status_code}"
+        except Exception as e:
+            METRICS.inc("sszb_responses_total", msg_id=msg_id, code="exception")
+            if not policy.should_retry(msg_id, attempt, error=e):
+                raise
+            reason = e
+        delay = policy.delay(attempt)
+        attempt += 1
+        METRICS.inc("sszb_retries_total", msg_id=msg_id)
+        print(f"[{note}] 请求 {msg_id} 失败 ({reason})，{delay:.1f} 秒后重试 ({attempt}/{policy.retries})")
+        time.sleep(delay)
+
+def _observe(msg_id, started, body, response, res=None):
+    """把一次请求的耗时、结果码和收发字节数记入运行指标 (未开启时直接返回)"""
+    if not METRICS.enabled:
+        return
+    if response.status_code != 200:
+        code = f"http_{response.status_code}"
+    else:
+        code = _response_code(res)
+        if code is None:
+            code = "invalid"
+    METRICS.observe_request(msg_id, time.perf_counter() - started, code,
+                            len(body), len(getattr(response, "content", None) or b""))
+
+def init_metrics(shard=None):
+    """按环境变量 SSZB_METRICS 或 settings.metrics 开启运行指标，输出目录取 settings.metrics_dir"""
+    METRICS.configure(enabled=METRICS.enabled or bool(get_setting("metrics", False)),
+                      directory=get_setting("metrics_dir"), shard=shard)
+    return METRICS
+
 def get_base_msg(account):
-    """构建基础消息体，包含 authKey 等必填项"""
-    return {
-        "authKey": account.get("authKey"),
-        "accountName": account.get("accountName", ""),
-        "roleID": int(account.get("roleID", 0)),
-        "pfID": get_common_param("pfID", 2),
-        "deviceID": get_common_param("deviceID", "b227a7c94278f2e9de046915c1d01c2f89dee3ba"),
-        "bundleIdentifier": get_common_param("bundleIdentifier", "com.bairimeng.snake.13"),
-        "version": get_common_param("version", "8.9.7")
-    }
+    """构建基础消息体，包含 authKey 等必填项 (取自编解码器的缓存，返回副本)"""
+    return dict(_CODEC.base(account)[0])
+
+# ================= 异步执行 =================
+def to_async(func):
+    """
+    把阻塞的请求函数包装成协程函数
+    
+    阻塞调用在线程池中执行，仍然共享同一个连接池传输层，
+    因此异步路径与同步路径的行为 (-73 重试、静默标记等) 完全一致。
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    wrapper.__doc__ = f"{func.__name__} 的异步版本\n\n{func.__doc__ or ''}"
+    return wrapper
+
+async def _run_accounts(accounts, worker, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    # 线程数与并发上限一致，避免默认线程池成为瓶颈
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    async def run_one(account):
+        note = account.get('note', '未知账号')
+        async with semaphore:
+            try:
+                await worker(account)
+                return True
+            except FatalAuthError:
+                print(f"!!!! 账号 {note} 遭遇严重认证错误，已跳过剩余任务 !!!!")
+            except Exception as e:
+                print(f"账号 {note} 执行任务时发生未知错误: {e}")
+            return False
+
+    return await asyncio.gather(*(run_one(account) for account in accounts))
+
+def run_accounts(accounts, worker, concurrency=None):
+    """
+    事件循环驱动：在有限并发下同时处理多个账号
+    
+    每个账号的异常 (包括 FatalAuthError) 只影响自身，不会取消其他账号。
+    目前由 daily_tasks 使用；sszb_monitor 不按账号驱动，而是每轮把所有目标的拉取合并后交给线程池执行。
+    
+    Args:
+        accounts: 账号配置字典列表
+        worker: 协程函数 async def worker(account)
+        concurrency: 同时处理的账号数上限，默认取 settings.concurrency (8)
+    
+    Returns:
+        list[bool]: 与 accounts 一一对应，表示该账号是否正常完成
+    """
+    if concurrency is None:
+        concurrency = get_setting("concurrency", 8)
+    if not accounts:
+        return []
+    return asyncio.run(_run_accounts(accounts, worker, max(1, int(concurrency))))
@@ -0,0 +1,107 @@
+"""
+bench_codec.py - 请求编解码微基准
+
+对比逐请求 json.dumps + quote 与 RequestCodec 拼接编码的吞吐量，
+以及 json / orjson 解析 30014 好友列表响应的吞吐量。
+
+用法:
+    python benchmarks/bench_codec.py --accounts 1000 --friends 100
+"""
+
+import sys, os, json, time, argparse, urllib.parse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import auth_manager
+from auth_manager import RequestCodec, get_base_msg
+
+def make_accounts(count):
+    return [{"note": f"bench{i}", "openID": f"open{i}", "authKey": f"{i:032x}", "roleID": str(30000000 + i), "accountName": f"角色{i}"}
+            for i in range(count)]
+
+def make_friend_list(count):
+    ids = list(range(40000000, 40000000 + count))
+    return {
+        "errorCode": 0,
+        "roleID": ids,
+        "status": [i % 3 for i in ids],
+        "gameMode": [(i % 3) - 1 for i in ids],
+        "statusDesc": ["在线" if i % 3 else "离线" for i in ids],
+        "isTop": [0 for _ in ids],
+        "spaceStatus": [{"newMood": "今天也要加油", "info": None} for _ in ids],
+        "publicInfos": [{"name": f"好友{i}", "icon": "", "area": "广东", "sex": "1", "age": "20", "ip": "1.1.1.1",
+                         "grade": i % 30, "vipExpireTime": 0, "levelInfo": {"level": 10, "curExp": 1, "nextExp": 2}} for i in ids],
+    }
+
+def rate(count, seconds):
+    return f"{count / seconds:>12,.0f} 次/秒"
+
+def bench_encode(accounts, rounds):
+    messages = []
+    for account in accounts:
+        msg = get_base_msg(account)
+        msg.update({"followType": 3, "startID": 1, "endID": 20, "onlineFirst": True})
+        messages.append((account, msg))
+
+    total = len(messages) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for account, msg in messages:
+            f"msg_id=30014&msg={urllib.parse.quote(json.dumps(msg, ensure_ascii=False))}"
+    plain = time.perf_counter() - start
+
+    codec = RequestCodec()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for account, msg in messages:
+            codec.encode(30014, msg, account)
+    cached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for account in accounts:
+            get_base_msg(account)
+    base = time.perf_counter() - start
+
+    print(f"编码 json.dumps + quote : {rate(total, plain)}")
+    print(f"编码 RequestCodec       : {rate(total, cached)}  ({plain / cached:.2f}x)")
+    print(f"get_base_msg (缓存)     : {rate(total, base)}")
+
+def bench_decode(friends, rounds):
+    class Response:
+        def __init__(self, content):
+            self.content = content
+        def json(self):
+            return json.loads(self.content)
+
+    response = Response(json.dumps(make_friend_list(friends), ensure_ascii=False).encode('utf-8'))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        json.loads(response.content)
+    plain = time.perf_counter() - start
+    print(f"解析 json ({friends} 好友)   : {rate(rounds, plain)}")
+
+    if auth_manager.orjson is None:
+        print("解析 orjson              : 未安装，跳过")
+        return
+    start = time.perf_counter()
+    for _ in range(rounds):
+        RequestCodec.decode(response)
+    fast = time.perf_counter() - start
+    print(f"解析 orjson ({friends} 好友) : {rate(rounds, fast)}  ({plain / fast:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description="请求编解码微基准")
+    parser.add_argument("--accounts", type=int, default=1000, help="模拟的账号数")
+    parser.add_argument("--rounds", type=int, default=20, help="每个账号编码的轮数")
+    parser.add_argument("--friends", type=int, default=100, help="好友列表响应的人数")
+    parser.add_argument("--decode-rounds", type=int, default=500, help="解析轮数")
+    args = parser.parse_args()
+
+    # 基准不读取 config.json，公共参数使用默认值
+    auth_manager._CONFIG_CACHE = {"common": {}}
+    bench_encode(make_accounts(args.accounts), args.rounds)
+    bench_decode(args.friends, args.decode_rounds)
+
+if __name__ == '__main__':
+    main()
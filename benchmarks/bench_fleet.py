@@ -0,0 +1,146 @@
+"""
+bench_fleet.py - 监控与每日任务的整体压测
+
+启动本地替身服务器 (standin_server.py)，用 1~1000 个合成账号驱动 sszb_monitor.main 与 daily_tasks.main，
+报告每秒请求数、单轮耗时的 p50/p99 与峰值内存 (RSS)。每种账号规模在独立的子进程中运行，
+峰值内存互不影响；配置文件、状态库与通知都放在临时目录，不会改动脚本目录下的文件。
+
+用法:
+    python benchmarks/bench_fleet.py --fleets 1,10,100,1000 --cycles 5 --latency 30
+    python benchmarks/bench_fleet.py --jobs monitor --auth-error-rate 0.02 --http-error-rate 0.01
+"""
+
+import sys, os, json, time, argparse, tempfile, shutil, subprocess, contextlib, urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standin_server
+
+# 每个合成账号监控的目标数 (目标从替身服务器的好友列表中选取，账号之间有重叠)
+TARGETS_PER_ACCOUNT = 2
+# 合成配置的默认运行参数 (--settings 可以覆盖)：
+# 关闭自适应轮询，否则第 2 轮起所有目标都未到检查时间，监控的每一轮都是空转
+BENCH_SETTINGS = {"adaptive_polling": False}
+
+def make_config(count, friends, settings):
+    accounts = []
+    for i in range(count):
+        role_id = 30000000 + i
+        targets = [{"id": 40000001 + (i * TARGETS_PER_ACCOUNT + j) % friends, "name": f"好友{j}"}
+                   for j in range(TARGETS_PER_ACCOUNT)]
+        accounts.append({"note": f"bench{i}", "openID": str(role_id), "openKey": "bench", "authKey": f"{i:032x}",
+                         "roleID": str(role_id), "accountName": f"bench{role_id}", "targets": targets})
+    return {"common": {}, "settings": settings, "accounts": accounts}
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存 (MB)，平台不支持时为 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def server_stats(base):
+    with urllib.request.urlopen(f"{base}/stats", timeout=10) as response:
+        return json.load(response)
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_worker(args):
+    """子进程：在临时目录中按给定规模运行若干轮，结果以一行 JSON 输出"""
+    import auth_manager, state_store, notifier
+
+    workdir = tempfile.mkdtemp(prefix="sszb_bench_")
+    try:
+        settings = dict(BENCH_SETTINGS, **(json.loads(args.settings) if args.settings else {}))
+        with open(os.path.join(workdir, "config.json"), 'w', encoding='utf-8') as f:
+            json.dump(make_config(args.accounts, args.friends, settings), f, ensure_ascii=False)
+
+        auth_manager.CONFIG_FILE = os.path.join(workdir, "config.json")
+        state_store._STORE = state_store.SqliteStore(os.path.join(workdir, "sszb_state.db"))
+        notifier.get_outbox(sink=lambda title, content: True, coalesce_window=0,
+                            spill_file=os.path.join(workdir, "notify_outbox.jsonl"))
+        auth_manager.set_transport(auth_manager.Transport(
+            base_url=args.url,
+            pool_connections=settings.get("pool_connections", 4),
+            pool_maxsize=settings.get("pool_maxsize", 16)))
+
+        if args.job == "monitor":
+            import sszb_monitor
+            run = lambda: sszb_monitor.main([])
+        else:
+            import daily_tasks
+            run = lambda: daily_tasks.main([])
+
+        base = args.url.split("/zgame/")[0]
+        before = server_stats(base)["total"]
+        cycles = []
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(args.cycles):
+                started = time.perf_counter()
+                run()
+                cycles.append(time.perf_counter() - started)
+        requests = server_stats(base)["total"] - before
+        print(json.dumps({"cycles": cycles, "requests": requests, "peak_rss_mb": peak_rss_mb()}))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_fleet(job, accounts, args, url):
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", job, "--url", url,
+           "--accounts", str(accounts), "--cycles", str(args.cycles), "--friends", str(args.friends),
+           "--settings", args.settings]
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', timeout=args.timeout)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"{job} x{accounts} 运行失败:\n{proc.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="监控与每日任务的整体压测 (本地替身服务器)")
+    parser.add_argument("--fleets", default="1,10,100,1000", help="账号规模，逗号分隔")
+    parser.add_argument("--jobs", default="monitor,daily", help="要压测的入口: monitor, daily")
+    parser.add_argument("--cycles", type=int, default=3, help="每个规模运行的轮数")
+    parser.add_argument("--settings", default="", help="写入合成配置 settings 节点的 JSON，例如 '{\"concurrency\": 32}'")
+    parser.add_argument("--timeout", type=float, default=1800, help="单个规模的超时时间 (秒)")
+    standin_server.add_arguments(parser)
+    # 子进程参数
+    parser.add_argument("--worker", choices=("monitor", "daily"), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--accounts", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.job = args.worker
+        run_worker(args)
+        return
+
+    server, url = standin_server.serve(standin_server.from_args(args))
+    print(f"替身服务器: {url}")
+    print(f"延迟 {args.latency}ms, 好友 {args.friends} 人, -73 概率 {args.auth_error_rate}, HTTP 错误概率 {args.http_error_rate}\n")
+    header = f"{'入口':<8}{'账号数':>8}{'请求数':>10}{'请求/秒':>10}{'p50(秒)':>10}{'p99(秒)':>10}{'峰值RSS(MB)':>14}"
+    print(header)
+    print("-" * len(header))
+    try:
+        for job in [j.strip() for j in args.jobs.split(",") if j.strip()]:
+            for accounts in [int(n) for n in args.fleets.split(",") if n.strip()]:
+                # 每个规模从全新的服务器状态开始 (每日奖励未领取)
+                urllib.request.urlopen(urllib.request.Request(f"{url.split('/zgame/')[0]}/reset", data=b""), timeout=10).close()
+                result = run_fleet(job, accounts, args, url)
+                total = sum(result["cycles"])
+                rss = result["peak_rss_mb"]
+                print(f"{job:<8}{accounts:>8}{result['requests']:>10}{result['requests'] / total if total else 0:>10.1f}"
+                      f"{percentile(result['cycles'], 0.5):>10.3f}{percentile(result['cycles'], 0.99):>10.3f}"
+                      f"{(f'{rss:.1f}' if rss is not None else 'n/a'):>14}", flush=True)
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+standin_server.py - snake_require 本地替身服务器
+
+在本机模拟 /zgame/?m=snake&a=snake_require，供压测与回归对比使用，不会访问真实服务器。
+
+支持的 msg_id:
+    30001 登录          30002 查看目标      30014 好友列表 (分页)
+    30250/30251 扭蛋    30685/30686 摇钱树  30843/30844 圣衣商城
+    31010/31011/31012 签到
+
+每个 roleID 的签到、摇树、扭蛋、礼包状态单独记录，同一账号重复运行每日任务时行为与真实服务器一致
+(第二次运行不再有可领取的奖励)。GET /stats 返回按 msg_id 统计的请求数，POST /reset 清空状态。
+
+用法:
+    python benchmarks/standin_server.py --port 8765 --latency 30 --friends 200 --auth-error-rate 0.01
+    python benchmarks/standin_server.py --latency 20 --stall-rate 0.02 --stall 10   # 模拟偶发卡住的连接
+"""
+
+import json, time, random, argparse, threading, urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class StandIn:
+    """替身服务器的可配置行为与每个角色的状态"""
+    def __init__(self, latency=0.0, friends=100, auth_error_rate=0.0, http_error_rate=0.0,
+                 free_draws=3, draw_cooldown=0, stall_rate=0.0, stall=0.0, seed=None):
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.friends = friends
+        self.auth_error_rate = auth_error_rate
+        self.http_error_rate = http_error_rate
+        self.free_draws = free_draws
+        self.draw_cooldown = draw_cooldown
+        self.random = random.Random(seed)
+        self.counts = {}
+        self.roles = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.roles.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"counts": dict(self.counts), "total": sum(self.counts.values())}
+
+    def role(self, role_id):
+        state = self.roles.get(role_id)
+        if state is None:
+            state = self.roles[role_id] = {"signed": False, "weekend": False, "shaken": False,
+                                           "gift": False, "draws": self.free_draws, "next_draw": 0}
+        return state
+
+    def handle(self, msg_id, msg):
+        """返回 (HTTP 状态码, 响应字典)"""
+        with self.lock:
+            self.counts[msg_id] = self.counts.get(msg_id, 0) + 1
+            roll = self.random.random()
+            stalled = self.random.random() < self.stall_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if stalled:
+            time.sleep(self.stall)
+        if roll < self.http_error_rate:
+            return 503, None
+        if msg_id != 30001 and roll < self.http_error_rate + self.auth_error_rate:
+            return 200, {"errorCode": -73, "errorMsg": "authKey expired"}
+
+        handler = getattr(self, f"msg_{msg_id}", None)
+        if handler is None:
+            return 200, {"errorCode": -1, "errorMsg": f"unknown msg_id {msg_id}"}
+        with self.lock:
+            return 200, handler(msg)
+
+    # ---------- 各 msg_id ----------
+    def msg_30001(self, msg):
+        role_id = int(msg.get("openID") or 0) or 10000000
+        return {"errorCode": 0, "authKey": f"{self.random.getrandbits(128):032x}", "roleID": role_id,
+                "accountName": f"bench{role_id}", "serverTimeStamp": int(time.time())}
+
+    def msg_30002(self, msg):
+        target = int(msg.get("requestRoleID", 0) or 0)
+        return {"errorCode": 0, "publicInfo": {"name": f"好友{target}", "grade": target % 30},
+                "todaySpaceVisitorNum": target % 7, "killCount": 1000 + target % 500,
+                "maxContinueKill": 20, "bestOverall": 50 + target % 50, "bestOverallProbability": 12,
+                "teamplayWinningTimes": 30, "teamplayWinningProbability": 55,
+                "gold": 500, "diamonds": 10, "goldNum": 1, "silverNum": 2, "copperNum": 3}
+
+    def msg_30014(self, msg):
+        start = max(1, int(msg.get("startID", 1)))
+        end = min(int(msg.get("endID", 20)), self.friends)
+        ids = list(range(40000000 + start, 40000000 + end + 1))
+        # 状态随时间变化，目标会在离线、在线、对局之间切换
+        tick = int(time.time() // 10)
+        status = [(i + tick) % 3 for i in ids]
+        return {
+            "errorCode": 0,
+            "totalCount": self.friends,
+            "roleID": ids,
+            "status": status,
+            "gameMode": [0 if s == 2 else -1 for s in status],
+            "statusDesc": ["游戏中" if s == 2 else ("在线" if s == 1 else "离线") for s in status],
+            "isTop": [0] * len(ids),
+            "spaceStatus": [{"newMood": "今天也要加油", "info": None} for _ in ids],
+            "publicInfos": [{"name": f"好友{i}", "icon": "", "area": "广东", "sex": "1", "age": "20", "ip": "1.1.1.1",
+                             "grade": i % 30, "vipExpireTime": 0, "levelInfo": {"level": 10, "curExp": 1, "nextExp": 2}}
+                            for i in ids],
+        }
+
+    def msg_30250(self, msg):
+        state = self.role(msg.get("roleID"))
+        return {"errorCode": 0, "infos": [{"coinFreeReaminCount": state["draws"], "coinFreeTime": state["next_draw"]}]}
+
+    def msg_30251(self, msg):
+        state = self.role(msg.get("roleID"))
+        if state["draws"] <= 0 or state["next_draw"] > time.time():
+            return {"errorCode": -2, "errorMsg": "cooling down"}
+        state["draws"] -= 1
+        state["next_draw"] = int(time.time()) + self.draw_cooldown
+        return {"errorCode": 0, "items": [{"itemID": 1, "count": 1}]}
+
+    def msg_30685(self, msg):
+        state = self.role(msg.get("roleID"))
+        return {"errorCode": 0, "oncePrice": 0, "residueTimes": 0 if state["shaken"] else 1}
+
+    def msg_30686(self, msg):
+        self.role(msg.get("roleID"))["shaken"] = True
+        return {"errorCode": 0, "items": [{"itemID": 2, "count": 100}]}
+
+    def msg_30843(self, msg):
+        bought = 1 if self.role(msg.get("roleID"))["gift"] else 0
+        return {"errorCode": 0, "infos": [{"clothGiftID": 7, "realPrice": 0, "boughtCount": bought, "totalCount": 1}]}
+
+    def msg_30844(self, msg):
+        self.role(msg.get("roleID"))["gift"] = True
+        return {"errorCode": 0, "items": [{"itemID": 3, "count": 1}]}
+
+    def msg_31010(self, msg):
+        state = self.role(msg.get("roleID"))
+        return {"errorCode": 0, "errCode": 0, "signDay": 1, "status": [0 if state["signed"] else 1],
+                "weekendStatus": 0 if state["weekend"] else 1}
+
+    def msg_31011(self, msg):
+        self.role(msg.get("roleID"))["signed"] = True
+        return {"errorCode": 0, "errCode": 0, "awards": [{"itemID": 4, "count": 1}]}
+
+    def msg_31012(self, msg):
+        self.role(msg.get("roleID"))["weekend"] = True
+        return {"errorCode": 0, "errCode": 0, "awards": [{"itemID": 5, "count": 1}]}
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b""
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 客户端已超时断开 (卡住的请求)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                self.reply(200, standin.stats())
+            else:
+                self.reply(404, None)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode('utf-8')
+            if self.path.startswith("/reset"):
+                standin.reset()
+                self.reply(200, {"ok": True})
+                return
+            try:
+                form = urllib.parse.parse_qs(body)
+                msg_id = int(form["msg_id"][0])
+                msg = json.loads(form["msg"][0])
+            except (KeyError, ValueError):
+                self.reply(400, None)
+                return
+            status, payload = standin.handle(msg_id, msg)
+            self.reply(status, payload)
+
+    return Handler
+
+def serve(standin, host="127.0.0.1", port=0):
+    """在后台线程启动替身服务器，返回 (server, 请求地址)"""
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/zgame/?m=snake&a=snake_require"
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的模拟延迟 (毫秒)")
+    parser.add_argument("--friends", type=int, default=100, help="好友列表人数")
+    parser.add_argument("--auth-error-rate", type=float, default=0, help="返回 -73 的概率 (登录请求除外)")
+    parser.add_argument("--http-error-rate", type=float, default=0, help="返回 HTTP 503 的概率")
+    parser.add_argument("--stall-rate", type=float, default=0, help="请求额外卡住 --stall 秒的概率 (模拟长尾延迟)")
+    parser.add_argument("--stall", type=float, default=10, help="卡住的时长 (秒)")
+    parser.add_argument("--draw-cooldown", type=int, default=0, help="免费扭蛋的冷却时间 (秒)")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子，便于复现注入的错误")
+
+def from_args(args):
+    return StandIn(latency=args.latency / 1000, friends=args.friends, auth_error_rate=args.auth_error_rate,
+                   http_error_rate=args.http_error_rate, draw_cooldown=args.draw_cooldown,
+                   stall_rate=args.stall_rate, stall=args.stall, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="snake_require 本地替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="监听端口，0 为随机端口")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = serve(from_args(args), args.host, args.port)
+    # 第一行输出请求地址，供压测脚本读取
+    print(url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
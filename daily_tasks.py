@@ -4,11 +4,14 @@ daily_tasks.py - 每日任务脚本
 功能:
 - 每日签到
 - 摇钱树
-- 三次免费扭蛋 (间隔约5分钟)
+- 三次免费扭蛋 (按冷却时间调度, 各账号交错执行)
+- 多账号并发执行
 """
 
-import time
-from auth_manager import load_config, make_request, get_base_msg, FatalAuthError
+import time, asyncio, heapq, itertools, argparse
+from auth_manager import load_config, make_request, get_base_msg, get_setting, FatalAuthError, to_async, run_accounts, init_metrics
+from profiler import PROFILER
+from sharding import select_shard, run_workers, report
 
 def daily_sign_in(account):
     """每日签到任务"""
@@ -39,7 +42,6 @@ def daily_sign_in(account):
 
     # 2. 周日领金币奖励 (31012)
     if info.get("weekendStatus") == 1:
-        time.sleep(1)
         print("发现周日金币奖励可领取，正在领取...")
         res = make_request(31012, msg_data_base, account)
         if res and res.get("errCode") == 0:
@@ -95,72 +97,194 @@ def cloth_shop_buy(account):
     else:
         print("今日没有可领取的免费礼包。")
 
-def lucky_draw(account):
-    """免费扭蛋任务 (每天3次, 间隔5分钟)"""
-    print(f"[{account.get('note')}] 检查扭蛋任务...")
+# ================= 扭蛋调度 =================
+# 抽取成功后隔几秒重新查询 30250，以服务器返回的 coinFreeTime 作为下一次的时间
+DRAW_RECHECK_DELAY = 3
+# 冷却结束后额外等待的秒数，避免与服务器时间存在微小误差
+COOLDOWN_MARGIN = 3
+# 单账号最多执行的检查/抽取次数，防止异常响应导致无限调度
+MAX_DRAW_STEPS = 8
+# 服务器的免费扭蛋冷却时间 (秒)，每天最多 3 次免费扭蛋，抽完至少要等 2 次冷却
+DRAW_COOLDOWN = 300
+# 多进程运行时分片的最短超时：3 次冷却再留 5 分钟给其他任务，--worker-timeout / settings.worker_timeout 小于此值时按此值
+DAILY_WORKER_TIMEOUT = 3 * DRAW_COOLDOWN + 300
+
+class CooldownScheduler:
+    """
+    基于最小堆的冷却调度器
+    
+    堆中保存 (到期时间, 序号, 账号, 任务)。等待期间只是一次 asyncio.sleep，
+    不占用线程；到期的任务在线程池中执行，返回下一次到期时间或 None (结束)。
+    任务抛出异常 (如认证失败) 的账号记入 failed (按账号对象去重，保持登记顺序)。
+    """
+    def __init__(self, concurrency=None):
+        self._heap = []
+        self._seq = itertools.count()
+        self.concurrency = concurrency or get_setting("concurrency", 8)
+        self._failed = {}
+
+    @property
+    def failed(self):
+        """任务出错的账号列表"""
+        return list(self._failed.values())
+
+    def schedule(self, due, account, task):
+        """登记一个任务，due 为 Unix 时间戳"""
+        heapq.heappush(self._heap, (due, next(self._seq), account, task))
+
+    async def _run_task(self, semaphore, account, task):
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(task, account)
+            except FatalAuthError:
+                print(f"!!!! 账号 {account.get('note')} 遭遇严重认证错误，已跳过剩余任务 !!!!")
+            except Exception as e:
+                print(f"账号 {account.get('note')} 执行任务时发生未知错误: {e}")
+            self._failed[id(account)] = account
+            return None
+
+    async def run(self):
+        """运行直到堆中没有任务"""
+        semaphore = asyncio.Semaphore(max(1, int(self.concurrency)))
+        while self._heap:
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = time.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, account, task = heapq.heappop(self._heap)
+                batch.append((account, task))
+
+            results = await asyncio.gather(*(self._run_task(semaphore, account, task) for account, task in batch))
+            for (account, task), next_due in zip(batch, results):
+                if next_due is not None:
+                    self.schedule(next_due, account, task)
+
+def make_lucky_draw_task(account):
+    """
+    创建单个账号的扭蛋任务
+    
+    每次执行先查询 30250：有免费次数且冷却结束则抽取，否则返回 coinFreeTime 作为下一次到期时间。
+    """
     msg_data_base = get_base_msg(account)
+    steps = itertools.count(1)
+
+    def task(account):
+        step = next(steps)
+        if step > MAX_DRAW_STEPS:
+            print(f"[{account.get('note')}] 扭蛋调度次数已达上限，停止。")
+            return None
 
-    for i in range(3):
-        print(f"--- 尝试第 {i+1} 次扭蛋 ---")
         info = make_request(30250, msg_data_base, account)
         if not info or "infos" not in info:
-            print("获取扭蛋信息失败")
-            break
-            
+            print(f"[{account.get('note')}] 获取扭蛋信息失败")
+            return None
+
         gacha_info = info["infos"][0]
         free_count = gacha_info.get("coinFreeReaminCount", 0)
         next_free_time = gacha_info.get("coinFreeTime", 0)
         now = int(time.time())
 
-        if free_count > 0:
-            print(f'免费机会剩余次数: {free_count}')
-            wait_time = next_free_time - now
-            if wait_time > 0:
-                print(f"免费冷却中，还需等待 {wait_time} 秒...")
-                if i < 2: 
-                    time.sleep(wait_time + 3)
-                    continue
-                else:
-                    break
-            
-            draw_data = msg_data_base.copy()
-            draw_data.update({"isActivity": 0, "luckyToyID": 1, "drawType": 5})
-            res = make_request(30251, draw_data, account)
-            if res and res.get("errorCode") == 0:
-                print(f"扭蛋成功！获得: {res.get('items')}")
-                if i < 2 and free_count > 1:
-                    print("等待5分钟后进行下一次...")
-                    time.sleep(301)
-            else:
-                break
-        else:
-            print("今日免费扭蛋已用完。")
-            break
+        if free_count <= 0:
+            print(f"[{account.get('note')}] 今日免费扭蛋已用完。")
+            return None
 
-def main():
+        print(f'[{account.get("note")}] 免费机会剩余次数: {free_count}')
+        wait_time = next_free_time - now
+        if wait_time > 0:
+            print(f"[{account.get('note')}] 免费冷却中，{wait_time} 秒后再试...")
+            return next_free_time + COOLDOWN_MARGIN
+
+        draw_data = msg_data_base.copy()
+        draw_data.update({"isActivity": 0, "luckyToyID": 1, "drawType": 5})
+        res = make_request(30251, draw_data, account)
+        if res and res.get("errorCode") == 0:
+            print(f"[{account.get('note')}] 扭蛋成功！获得: {res.get('items')}")
+            if free_count > 1:
+                return time.time() + DRAW_RECHECK_DELAY
+        return None
+
+    return task
+
+def run_lucky_draws(accounts):
+    """所有账号的扭蛋任务共用一个调度器，各账号的冷却时间相互交错；返回扭蛋出错的账号列表"""
+    scheduler = CooldownScheduler()
+    now = time.time()
+    for account in accounts:
+        print(f"[{account.get('note')}] 检查扭蛋任务...")
+        scheduler.schedule(now, account, make_lucky_draw_task(account))
+    with PROFILER.span("lucky_draw"):
+        asyncio.run(scheduler.run())
+    return scheduler.failed
+
+def lucky_draw(account):
+    """免费扭蛋任务 (每天3次, 间隔5分钟)"""
+    run_lucky_draws([account])
+
+# 各任务的异步版本 (阻塞请求在线程池中执行)
+async_daily_sign_in = to_async(daily_sign_in)
+async_shake_tree = to_async(shake_tree)
+async_cloth_shop_buy = to_async(cloth_shop_buy)
+
+async def run_account_tasks(account):
+    """依次执行单个账号的各项每日任务，FatalAuthError 由 run_accounts 按账号隔离处理"""
+    print(f"\n>>>> 开始处理账号: {account.get('note')} <<<<")
+    # 请求节奏由 auth_manager 的限速器统一控制，任务之间不再固定等待
+    with PROFILER.span("sign_in"):
+        await async_daily_sign_in(account)
+    with PROFILER.span("shake_tree"):
+        await async_shake_tree(account)
+    with PROFILER.span("cloth_shop"):
+        await async_cloth_shop_buy(account)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="蛇蛇争霸每日任务")
+    parser.add_argument("--profile", nargs="?", const="spans", default=None, metavar="OPTIONS",
+                        help="开启性能剖析: spans (默认) / cprofile / tracemalloc / all，可用逗号组合；也可设置环境变量 SSZB_PROFILE")
+    parser.add_argument("--workers", type=int, default=None, help="按 roleID 把账号分到多个进程运行，默认取 settings.workers (1 为单进程)")
+    parser.add_argument("--worker-timeout", type=float, default=None, help=f"分片的超时时间 (秒)，默认取 settings.worker_timeout，且不小于 {DAILY_WORKER_TIMEOUT} (扭蛋需等待冷却)")
+    return parser.parse_args(argv)
+
+def run_tasks(accounts, profile=None, job="daily", shard=None):
+    """执行一批账号的每日任务，返回认证失败或出错的账号备注列表"""
+    metrics = init_metrics(shard=shard)
+    PROFILER.start(job, profile)
+    try:
+        # 各账号并发执行，单个账号认证失败不影响其他账号
+        with metrics.cycle("daily"):
+            results = run_accounts(accounts, run_account_tasks)
+
+            # 扭蛋需要等待冷却，统一交给调度器在所有账号之间交错执行
+            draw_failed = run_lucky_draws([account for account, ok in zip(accounts, results) if ok])
+        metrics.write_files()
+    finally:
+        PROFILER.finish()
+    failed = {id(account) for account in draw_failed}
+    return [account.get('note') for account, ok in zip(accounts, results) if not ok or id(account) in failed]
+
+def run_shard(args, shard):
+    """分片进程入口：只执行归属于本分片的账号，返回结果摘要"""
+    config = load_config()
+    accounts = select_shard(config.get("accounts", []) if config else [], shard)
+    print(f"[分片 {shard[0]}] 负责 {len(accounts)} 个账号。")
+    failed = run_tasks(accounts, args.profile, f"daily_shard{shard[0]}", shard[0])
+    return {"账号": len(accounts), "失败": ", ".join(map(str, failed)) or "无"}
+
+def main(argv=None):
+    args = parse_args(argv)
     config = load_config()
     if not config:
         return
 
-    for account in config.get("accounts", []):
-        print(f"\n>>>> 开始处理账号: {account.get('note')} <<<<")
-        
-        try:
-            # 依次执行各项任务
-            daily_sign_in(account)
-            time.sleep(1)
-            shake_tree(account)
-            time.sleep(1)
-            cloth_shop_buy(account)
-            time.sleep(1)
-            lucky_draw(account)
-            
-        except FatalAuthError:
-            print(f"!!!! 账号 {account.get('note')} 遭遇严重认证错误，已跳过剩余任务 !!!!")
-            continue
-        except Exception as e:
-            print(f"账号 {account.get('note')} 执行任务时发生未知错误: {e}")
-            continue
+    workers = args.workers if args.workers is not None else get_setting("workers", 1)
+    if workers > 1:
+        timeout = max(args.worker_timeout or get_setting("worker_timeout", DAILY_WORKER_TIMEOUT), DAILY_WORKER_TIMEOUT)
+        report(run_workers(run_shard, args, workers, timeout=timeout, name="daily"))
+        return
+
+    run_tasks(config.get("accounts", []), args.profile)
 
 if __name__ == "__main__":
     main()
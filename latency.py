@@ -0,0 +1,132 @@
+"""
+latency.py - 自适应超时与对冲请求
+
+提供:
+- 按 msg_id 统计最近的请求耗时 (LatencyTracker)，由滚动分位数推出每个 msg_id 的超时时间，
+  卡住的连接不再固定等满 15 秒
+- 对冲请求 (hedged)：幂等的读请求超过 p95 仍未返回时再发一份，取先返回的结果；
+  对冲数量受预算限制，不会在服务器整体变慢时把请求量翻倍
+
+只有 HEDGE_SAFE_MSG_IDS 中的查询类请求会被对冲，签到、抽奖、购买等有副作用的请求永远只发一次。
+"""
+
+import math, threading, collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 可以安全重复发送的只读请求: 好友列表、查看目标、扭蛋/摇钱树/圣衣商城/签到信息
+HEDGE_SAFE_MSG_IDS = frozenset((30014, 30002, 30250, 30685, 30843, 31010))
+
+class LatencyTracker:
+    """
+    按 msg_id 记录最近 window 次请求的耗时
+
+    超时时间 = 分位数 (timeout_percentile) × multiplier，限制在 [min_timeout, max_timeout] 之间；
+    样本不足 min_samples 时使用 max_timeout。超时的请求按超时时间记为一个样本，
+    服务器变慢时超时会随之放宽，而不是越收越紧。
+    """
+    def __init__(self, window=200, min_samples=20, timeout_percentile=0.99, multiplier=3.0,
+                 min_timeout=3.0, max_timeout=15.0, hedge_percentile=0.95):
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_percentile = timeout_percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hedge_percentile = hedge_percentile
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, msg_id, seconds):
+        key = str(msg_id)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, msg_id, q):
+        """最近样本的 q 分位数 (最近邻法)，样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = self._samples.get(str(msg_id))
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def timeout(self, msg_id):
+        """该 msg_id 当前的请求超时时间 (秒)"""
+        value = self.percentile(msg_id, self.timeout_percentile)
+        if value is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, value * self.multiplier))
+
+    def hedge_delay(self, msg_id):
+        """发出对冲请求前等待的时间 (p95)，样本不足时返回 None (不对冲)"""
+        return self.percentile(msg_id, self.hedge_percentile)
+
+    def snapshot(self):
+        """各 msg_id 的样本数、p50/p95/p99 与当前超时"""
+        with self._lock:
+            keys = list(self._samples)
+        result = {}
+        for key in keys:
+            result[key] = {"samples": len(self._samples[key]), "timeout": round(self.timeout(key), 3)}
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                value = self.percentile(key, q)
+                result[key][name] = None if value is None else round(value, 4)
+        return result
+
+class Hedger:
+    """
+    对冲请求执行器
+
+    首个请求超过 hedge_delay 仍未完成时再提交一份，返回先成功的结果；
+    两份都失败时抛出首个请求的异常。已发出的对冲数不超过总请求数的 budget 比例；
+    调用方还可以传入 admit，在发出对冲前检查 (如限速器是否还有空余名额)。
+    落后的那份请求不会被取消 (requests 无法中途取消)，在后台线程中自然结束。
+    """
+    def __init__(self, max_workers=16, budget=0.1):
+        self.budget = budget
+        self.requests = 0
+        self.hedges = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+
+    def _allow_hedge(self, admit=None):
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            if admit is not None and not admit():
+                return False
+            self.hedges += 1
+            return True
+
+    def call(self, func, hedge_delay, backup_func=None, admit=None):
+        """
+        执行 func()，必要时对冲
+
+        Args:
+            backup_func: 对冲时执行的函数，默认同 func
+            admit: 发出对冲前调用，返回 False 时不对冲 (只在预算允许时调用)
+
+        Returns:
+            tuple: (结果, 胜出方)；胜出方为 None (未对冲)、"primary" 或 "backup"
+        """
+        with self._lock:
+            self.requests += 1
+        primary = self._executor.submit(func)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done or not self._allow_hedge(admit):
+            return primary.result(), None
+
+        backup = self._executor.submit(backup_func or func)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (primary, backup):
+                if future in done and future.exception() is None:
+                    return future.result(), "primary" if future is primary else "backup"
+        return primary.result(), "primary"
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
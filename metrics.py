@@ -0,0 +1,201 @@
+"""
+metrics.py - 运行指标
+
+提供:
+- 按 msg_id 统计的请求耗时直方图、errorCode 计数 (含 -73、HTTP 错误和异常)、收发字节数
+- 登录尝试/成功次数，监控与每日任务的单轮耗时
+- 导出为 Prometheus textfile (sszb_metrics.prom) 和 JSON 快照 (sszb_metrics.json)
+
+默认关闭，关闭时各记录函数只做一次布尔判断。
+通过环境变量 SSZB_METRICS=1 或 settings.metrics 开启。
+"""
+
+import os, json, time, threading, contextlib
+from state_store import DATA_DIR
+
+# 耗时直方图的桶上界 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300)
+
+# 指标说明，同时决定 Prometheus 输出中的类型
+METRIC_HELP = {
+    "sszb_request_duration_seconds": ("histogram", "请求耗时 (含解析)"),
+    "sszb_responses_total": ("counter", "按 errorCode 统计的响应数，HTTP 错误记为 http_<状态码>，异常记为 exception"),
+    "sszb_bytes_sent_total": ("counter", "发送的请求体字节数"),
+    "sszb_bytes_received_total": ("counter", "接收的响应体字节数"),
+    "sszb_hedged_requests_total": ("counter", "发出对冲请求的次数，winner 为先返回的一方 (primary / backup)"),
+    "sszb_retries_total": ("counter", "暂时性失败后的重试次数"),
+    "sszb_short_circuited_total": ("counter", "熔断器打开期间被短路 (未发出) 的请求数，scope 为 account / endpoint"),
+    "sszb_breaker_trips_total": ("counter", "熔断器打开次数，scope 为 account / endpoint / auth"),
+    "sszb_login_attempts_total": ("counter", "登录 (30001) 尝试次数"),
+    "sszb_login_success_total": ("counter", "登录成功次数"),
+    "sszb_cycle_duration_seconds": ("histogram", "单轮执行耗时"),
+    "sszb_cycle_last_seconds": ("gauge", "最近一轮的执行耗时"),
+}
+
+class Histogram:
+    """累计直方图：各桶计数、总和与样本数"""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {"buckets": buckets, "sum": round(self.sum, 6), "count": self.count}
+
+class Metrics:
+    """
+    进程内指标注册表 (线程安全)
+
+    指标按 (名称, 标签) 存放；标签为排好序的 (键, 值) 元组。
+    """
+    def __init__(self, enabled=False, directory=DATA_DIR):
+        self.enabled = enabled
+        self.directory = directory
+        self.shard = None
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, directory=None, shard=None):
+        """shard 为分片编号时，导出的指标带 shard 标签，文件名为 sszb_metrics.shard<N>.*"""
+        if enabled is not None:
+            self.enabled = enabled
+        if directory:
+            self.directory = directory
+        if shard is not None:
+            self.shard = shard
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def observe_request(self, msg_id, seconds, code, sent=0, received=0):
+        """记录一次请求：耗时、结果码和收发字节数"""
+        if not self.enabled:
+            return
+        self.observe("sszb_request_duration_seconds", seconds, msg_id=msg_id)
+        self.inc("sszb_responses_total", msg_id=msg_id, code=code)
+        if sent:
+            self.inc("sszb_bytes_sent_total", sent, msg_id=msg_id)
+        if received:
+            self.inc("sszb_bytes_received_total", received, msg_id=msg_id)
+
+    @contextlib.contextmanager
+    def cycle(self, job):
+        """统计一轮执行的耗时 (job: monitor / daily)"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("sszb_cycle_duration_seconds", elapsed, job=job)
+            self.set("sszb_cycle_last_seconds", elapsed, job=job)
+
+    # ---------- 导出 ----------
+    def snapshot(self):
+        """当前全部指标的 JSON 友好副本"""
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = [(key, hist.to_dict()) for key, hist in self._histograms.items()]
+        result = {"timestamp": time.time()}
+        for (name, labels), value in counters + gauges + histograms:
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        snap = self.snapshot()
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            samples = snap.get(name)
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                labels, value = sample["labels"], sample["value"]
+                if self.shard is not None:
+                    labels = dict(labels, shard=self.shard)
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for bound, count in value["buckets"].items():
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_files(self):
+        """
+        写出 sszb_metrics.prom 和 sszb_metrics.json (分片进程为 sszb_metrics.shard<N>.*)
+        
+        原子替换，textfile 收集器不会读到半个文件。
+        """
+        if not self.enabled:
+            return
+        base = "sszb_metrics" if self.shard is None else f"sszb_metrics.shard{self.shard}"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _atomic_write(os.path.join(self.directory, f"{base}.prom"), self.render_prometheus())
+            _atomic_write(os.path.join(self.directory, f"{base}.json"),
+                          json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+        except Exception as e:
+            print(f"写出运行指标失败: {e}")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+def _atomic_write(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# 全局指标 (两个入口脚本与 auth_manager 共用)
+METRICS = Metrics(enabled=os.environ.get("SSZB_METRICS", "").lower() in ("1", "true", "yes"))
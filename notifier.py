@@ -0,0 +1,188 @@
+"""
+notifier.py - 通知发件箱
+
+提供:
+- 有界队列 + 后台线程推送, 监控主循环不等待推送完成
+- 同一接收方在合并窗口内的多条消息合并为一条推送
+- 令牌桶限速, 避免触发推送服务的频率限制
+- 推送失败或队列已满时落盘 (notify_outbox.jsonl), 之后自动补发
+"""
+
+import os, sys, json, time, queue, threading, atexit, builtins
+from state_store import DATA_DIR
+from ratelimit import TokenBucket
+
+# ================= 配置区域 =================
+OUTBOX_FILE = os.path.join(DATA_DIR, 'notify_outbox.jsonl')
+# 推送失败后再次尝试补发落盘消息的间隔 (秒)
+RETRY_INTERVAL = 60
+
+# 全局发件箱 (惰性创建)
+_OUTBOX = None
+_OUTBOX_LOCK = threading.Lock()
+
+def _find_qlapi():
+    """查找青龙面板注入的 QLAPI (builtins 或主模块全局变量)"""
+    api = getattr(builtins, 'QLAPI', None)
+    if api is None:
+        api = getattr(sys.modules.get('__main__'), 'QLAPI', None)
+    return api
+
+def deliver(title, content):
+    """
+    实际推送一条通知：通过青龙面板发送，不可用时打印到控制台
+
+    Returns:
+        bool: 是否推送成功 (打印到控制台视为成功)
+    """
+    api = _find_qlapi()
+    if api is None:
+        print(f"\n[NOTIFICATION] {title}\n{content}\n")
+        return True
+    try:
+        print(f"正在发送通知: {title}", api.systemNotify({"title": title, "content": content}))
+        return True
+    except Exception as e:
+        print(f"发送通知失败: {e}")
+        return False
+
+class Outbox:
+    """
+    通知发件箱
+
+    put 只把消息放进有界队列后立即返回；后台线程按接收方合并窗口内的消息，
+    经令牌桶限速后交给 sink 推送。推送失败或队列已满的消息追加到 spill_file，
+    启动时和之后每隔 RETRY_INTERVAL 秒重新入队。
+    """
+    def __init__(self, sink=deliver, maxsize=1000, coalesce_window=2.0, rate=1.0, burst=5, spill_file=OUTBOX_FILE):
+        self.sink = sink
+        self.coalesce_window = coalesce_window
+        self.spill_file = spill_file
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._bucket = TokenBucket(rate, burst)
+        self._spill_lock = threading.Lock()
+        self._last_retry = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="notify-outbox", daemon=True)
+        self._load_spilled()
+        self._thread.start()
+
+    def put(self, title, content, recipient="default"):
+        """加入一条通知，不等待推送"""
+        item = {"recipient": recipient, "title": title, "content": content, "time": time.time()}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            print(f"通知队列已满，写入磁盘: {title}")
+            self._spill([item])
+
+    def flush(self, timeout=30):
+        """等待队列中的通知发送完毕 (最多 timeout 秒)，返回是否已全部发送"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    # ---------- 后台线程 ----------
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=RETRY_INTERVAL)
+            except queue.Empty:
+                self._retry_spilled()
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                for items in self._group(batch):
+                    self._send(items)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if time.monotonic() - self._last_retry >= RETRY_INTERVAL:
+                self._retry_spilled()
+
+    @staticmethod
+    def _group(batch):
+        groups = {}
+        for item in batch:
+            groups.setdefault(item["recipient"], []).append(item)
+        return groups.values()
+
+    def _send(self, items):
+        if len(items) == 1:
+            title, content = items[0]["title"], items[0]["content"]
+        else:
+            title = f"{items[0]['title']} 等 {len(items)} 条通知"
+            content = "\n\n".join(f"【{item['title']}】\n{item['content']}" for item in items)
+        self._bucket.acquire()
+        try:
+            ok = self.sink(title, content)
+        except Exception as e:
+            print(f"推送通知出错: {e}")
+            ok = False
+        if not ok:
+            self._spill(items)
+
+    # ---------- 落盘 ----------
+    def _spill(self, items):
+        with self._spill_lock:
+            try:
+                with open(self.spill_file, 'a', encoding='utf-8') as f:
+                    for item in items:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"通知写入磁盘失败: {e}")
+
+    def _load_spilled(self):
+        """把落盘的通知重新入队 (先改名再读取，多个进程不会重复补发)"""
+        if not os.path.exists(self.spill_file):
+            return 0
+        processing = f"{self.spill_file}.{os.getpid()}"
+        with self._spill_lock:
+            try:
+                os.replace(self.spill_file, processing)
+            except OSError:
+                return 0
+        items = []
+        with open(processing, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    continue
+        os.remove(processing)
+        overflow = []
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                overflow.append(item)
+        if overflow:
+            self._spill(overflow)
+        return len(items) - len(overflow)
+
+    def _retry_spilled(self):
+        self._last_retry = time.monotonic()
+        count = self._load_spilled()
+        if count:
+            print(f"补发 {count} 条落盘通知。")
+
+def get_outbox(**kwargs):
+    """获取全局发件箱，首次调用时按 kwargs 创建；进程退出前会等待队列发送完毕"""
+    global _OUTBOX
+    with _OUTBOX_LOCK:
+        if _OUTBOX is None:
+            flush_timeout = kwargs.pop("flush_timeout", 30)
+            _OUTBOX = Outbox(**kwargs)
+            atexit.register(_OUTBOX.flush, flush_timeout)
+        return _OUTBOX
@@ -0,0 +1,200 @@
+"""
+profiler.py - 按需开启的性能剖析
+
+提供:
+- 命名阶段 (span) 计时：fetch / decode / lookup / state_load / state_save / record_save / render / notify 等
+- 可选 cProfile (含线程池中的工作线程) 与 tracemalloc 内存分配采样
+- 每次运行结束在状态文件旁的 profiles/ 目录写出阶段汇总、.prof 文件和内存分配报告
+
+通过环境变量 SSZB_PROFILE 或入口脚本的 --profile 开启，取值为逗号分隔的选项:
+    spans       只统计阶段耗时 (1 / true 等同于 spans)
+    cprofile    同时运行 cProfile
+    tracemalloc 同时采样内存分配
+    all         以上全部
+未开启时 span() 返回共享的空上下文，几乎没有开销。
+"""
+
+import os, sys, time, datetime, threading, contextlib
+from state_store import get_store
+
+PROFILE_OPTIONS = ("spans", "cprofile", "tracemalloc")
+# 内存分配报告中列出的条目数
+TRACEMALLOC_TOP = 30
+# 阶段汇总中 cProfile 按累计耗时列出的函数数
+CPROFILE_TOP = 40
+
+_NULL_SPAN = contextlib.nullcontext()
+
+def parse_profile_spec(spec):
+    """把 "cprofile,tracemalloc" 之类的开关解析为选项集合，空值返回空集合"""
+    if not spec:
+        return set()
+    options = set()
+    for part in str(spec).lower().replace(" ", "").split(","):
+        if part in ("1", "true", "yes", "on", "spans"):
+            options.add("spans")
+        elif part == "all":
+            options.update(PROFILE_OPTIONS)
+        elif part in PROFILE_OPTIONS:
+            options.update(("spans", part))
+        elif part not in ("", "0", "false", "no", "off"):
+            print(f"未知的剖析选项: {part}")
+    return options
+
+class Profiler:
+    """
+    进程内剖析器
+
+    各阶段按名称累计 次数 / 总耗时 / 最长耗时；多线程同时进入同一阶段时耗时会重叠计算，
+    因此总耗时反映的是该阶段占用的线程时间，而不是墙钟时间。
+    """
+    def __init__(self):
+        self.enabled = False
+        self.options = set()
+        self.job = None
+        self._spans = {}
+        self._lock = threading.Lock()
+        self._started = None
+        self._profiles = []
+
+    def span(self, name):
+        """阶段计时上下文，未开启时为空操作"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stat = self._spans.get(name)
+                if stat is None:
+                    self._spans[name] = [1, elapsed, elapsed]
+                else:
+                    stat[0] += 1
+                    stat[1] += elapsed
+                    stat[2] = max(stat[2], elapsed)
+
+    def start(self, job, spec=None):
+        """
+        按开关开始剖析 (spec 为空时读取环境变量 SSZB_PROFILE)
+
+        Returns:
+            bool: 是否已开启
+        """
+        self.options = parse_profile_spec(spec or os.environ.get("SSZB_PROFILE"))
+        if not self.options:
+            return False
+        self.job = job
+        self._spans.clear()
+        self._profiles = []
+        self._started = time.perf_counter()
+        if "tracemalloc" in self.options:
+            import tracemalloc
+            tracemalloc.start(10)
+        if "cprofile" in self.options:
+            self._start_cprofile()
+        self.enabled = True
+        print(f"已开启性能剖析: {', '.join(sorted(self.options))}")
+        return True
+
+    def _start_cprofile(self):
+        import cProfile
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        profile.enable()
+
+        # 线程池中的工作线程各自挂一个 Profile；
+        # Python 3.12 起 cProfile 改用 sys.monitoring，同一时刻只能开启一个，主线程的那个已覆盖全部线程
+        def thread_hook(frame, event, arg):
+            sys.setprofile(None)
+            worker = cProfile.Profile()
+            try:
+                worker.enable()
+            except ValueError:
+                return
+            with self._lock:
+                self._profiles.append(worker)
+
+        threading.setprofile(thread_hook)
+
+    def finish(self):
+        """停止剖析并写出报告，返回写出的文件列表"""
+        if not self.enabled:
+            return []
+        self.enabled = False
+        elapsed = time.perf_counter() - self._started
+
+        snapshot = None
+        if "tracemalloc" in self.options:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stats = None
+        if "cprofile" in self.options:
+            threading.setprofile(None)
+            stats = self._collect_cprofile()
+
+        directory = os.path.join(os.path.dirname(os.path.abspath(get_store().path)), "profiles")
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"{self.job}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+        written = []
+
+        with open(f"{prefix}.spans.txt", 'w', encoding='utf-8') as f:
+            f.write(self.report(elapsed))
+            if stats is not None:
+                f.write(f"\n\ncProfile (按累计耗时前 {CPROFILE_TOP} 项)\n")
+                stats.stream = f
+                stats.sort_stats("cumulative").print_stats(CPROFILE_TOP)
+        written.append(f"{prefix}.spans.txt")
+
+        if stats is not None:
+            stats.dump_stats(f"{prefix}.prof")
+            written.append(f"{prefix}.prof")
+
+        if snapshot is not None:
+            with open(f"{prefix}.alloc.txt", 'w', encoding='utf-8') as f:
+                f.write(f"峰值已分配内存: {peak / 1024 / 1024:.2f} MB\n")
+                f.write(f"按代码行统计的存活分配 (前 {TRACEMALLOC_TOP} 项):\n")
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                    f.write(f"{stat}\n")
+            written.append(f"{prefix}.alloc.txt")
+
+        print(self.report(elapsed))
+        print("剖析报告已写入:\n" + "\n".join(f"  {path}" for path in written))
+        return written
+
+    def _collect_cprofile(self):
+        import pstats
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            profile.disable()
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # 没有采集到任何调用的 Profile
+                continue
+        return stats
+
+    def report(self, elapsed=None):
+        """阶段耗时汇总表"""
+        with self._lock:
+            rows = sorted(self._spans.items(), key=lambda item: item[1][1], reverse=True)
+        lines = [f"[{self.job}] 阶段耗时" + (f" (运行 {elapsed:.3f} 秒)" if elapsed is not None else "")]
+        lines.append(f"{'阶段':<14}{'次数':>8}{'总耗时(秒)':>14}{'平均(毫秒)':>14}{'最长(毫秒)':>14}")
+        for name, (count, total, longest) in rows:
+            lines.append(f"{name:<14}{count:>8}{total:>14.3f}{total / count * 1000:>14.2f}{longest * 1000:>14.2f}")
+        return "\n".join(lines)
+
+# 全局剖析器 (两个入口脚本与 auth_manager 共用)
+PROFILER = Profiler()
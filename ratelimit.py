@@ -0,0 +1,210 @@
+"""
+ratelimit.py - 请求限速
+
+提供:
+- 令牌桶 (TokenBucket)，速率可以在运行中调整
+- 自适应限速器 (AdaptiveLimiter)：每个 msg_id 一个令牌桶，外加全局并发窗口，
+  按 AIMD (加性增、乘性减) 根据请求耗时、HTTP 错误和非零 errorCode 调整，
+  吞吐量会自动升到服务器能承受的最高水平，拥塞信号持续出现时按比例回退
+"""
+
+import time, threading, contextlib
+
+# errorCode 为这些值时不视为拥塞 (-73 为认证过期，由认证逻辑处理)
+NON_CONGESTION_CODES = (0, -73)
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个令牌，最多积攒 capacity 个"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """取一个令牌，不足时不等待，返回 False"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def set_rate(self, rate):
+        """调整速率 (已积攒的令牌按旧速率结算)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+class _Call:
+    """一次受限请求的结果登记"""
+    __slots__ = ("status", "code", "started")
+
+    def __init__(self):
+        self.status = None
+        self.code = None
+        self.started = time.monotonic()
+
+    def observe(self, status, code=None):
+        """登记 HTTP 状态码和 errorCode"""
+        self.status = status
+        self.code = code
+
+class AdaptiveLimiter:
+    """
+    全进程共享的 AIMD 限速器
+
+    每个 msg_id 的速率从 initial_rate 开始。第一次回退之前处于慢启动，每次正常响应速率加 1 (约每秒翻倍)；
+    之后每次正常响应增加 increase / 当前速率 (满速运行时约每秒增加 increase)。
+    速率最高为该 msg_id 的预算 (budgets，未配置时为 max_rate)；并发窗口同理每次增加 1 / 窗口。
+    
+    拥塞信号为 HTTP 非 200、请求异常、耗时超过 latency_target、errorCode 不在 NON_CONGESTION_CODES。
+    每个 msg_id 按指数滑动平均统计信号比例，超过 congestion_threshold 时速率与窗口乘以 decrease，
+    偶发的单个错误不会触发回退；每 decrease_interval 秒最多回退一次，避免一次拥塞被重复惩罚。
+    """
+    def __init__(self, initial_rate=10.0, min_rate=0.5, max_rate=50.0, budgets=None,
+                 concurrency=8, min_concurrency=1, max_concurrency=64,
+                 latency_target=2.0, increase=1.0, decrease=0.7, decrease_interval=1.0,
+                 congestion_threshold=0.2, smoothing=0.1):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.budgets = {str(k): float(v) for k, v in (budgets or {}).items()}
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.congestion_threshold = congestion_threshold
+        self.smoothing = smoothing
+        self.window = float(min(max(concurrency, min_concurrency), max_concurrency))
+        self._buckets = {}
+        self._last_decrease = {}
+        self._congestion = {}
+        self._slow_start = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+
+    def budget(self, msg_id):
+        return min(self.budgets.get(str(msg_id), self.max_rate), self.max_rate)
+
+    def rate(self, msg_id):
+        """msg_id 当前的速率 (次/秒)"""
+        return self._bucket(msg_id).rate
+
+    def _bucket(self, msg_id):
+        key = str(msg_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate = min(self.initial_rate, self.budget(key))
+                    # 桶容量为 1 秒的令牌，空闲后的突发不超过当前速率
+                    bucket = self._buckets[key] = TokenBucket(rate, max(1.0, rate))
+        return bucket
+
+    @contextlib.contextmanager
+    def request(self, msg_id):
+        """
+        受限执行一次请求：等待令牌与并发窗口，结束后按结果调整速率
+
+        用法:
+            with limiter.request(30014) as call:
+                response = ...
+                call.observe(response.status_code, error_code)
+        with 块内抛出异常视为拥塞。
+        """
+        self._bucket(msg_id).acquire()
+        with self._slot_free:
+            while self._in_flight >= int(self.window):
+                self._slot_free.wait()
+            self._in_flight += 1
+        call = _Call()
+        try:
+            yield call
+        except BaseException:
+            self._feedback(msg_id, True)
+            raise
+        self.release(msg_id, call)
+
+    def try_acquire(self, msg_id):
+        """
+        不等待地占用一个令牌和并发名额 (用于对冲请求)，限速器已饱和时返回 None
+
+        成功时返回 _Call，请求结束后必须调用 release(msg_id, call)；请求异常时 call 不登记状态码即视为拥塞。
+        """
+        bucket = self._bucket(msg_id)
+        with self._slot_free:
+            if self._in_flight >= int(self.window) or not bucket.try_acquire():
+                return None
+            self._in_flight += 1
+        return _Call()
+
+    def release(self, msg_id, call):
+        """归还 try_acquire / request 占用的名额，并按 call 登记的结果调整速率"""
+        elapsed = time.monotonic() - call.started
+        congested = (call.status != 200 or elapsed > self.latency_target
+                     or (call.code is not None and call.code not in NON_CONGESTION_CODES))
+        self._feedback(msg_id, congested)
+
+    def _feedback(self, msg_id, congested):
+        key = str(msg_id)
+        bucket = self._bucket(key)
+        with self._slot_free:
+            self._in_flight -= 1
+            level = self._congestion.get(key, 0.0) * (1 - self.smoothing) + (self.smoothing if congested else 0.0)
+            self._congestion[key] = level
+            now = time.monotonic()
+            if level > self.congestion_threshold:
+                if now - self._last_decrease.get(key, 0) >= self.decrease_interval:
+                    self._last_decrease[key] = now
+                    self._slow_start[key] = False
+                    bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+                    self.window = max(float(self.min_concurrency), self.window * self.decrease)
+            elif not congested:
+                step = 1.0 if self._slow_start.get(key, True) else self.increase / bucket.rate
+                bucket.set_rate(min(self.budget(key), bucket.rate + step))
+                self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+            self._slot_free.notify_all()
+
+    def snapshot(self):
+        """当前各 msg_id 的速率与并发窗口"""
+        with self._lock:
+            rates = {key: round(bucket.rate, 3) for key, bucket in self._buckets.items()}
+            return {"rates": rates, "window": round(self.window, 3), "in_flight": self._in_flight}
+
+class NullLimiter:
+    """关闭限速时使用：不等待、不调整"""
+    @contextlib.contextmanager
+    def request(self, msg_id):
+        yield _Call()
+
+    def try_acquire(self, msg_id):
+        return _Call()
+
+    def release(self, msg_id, call):
+        pass
+
+    def snapshot(self):
+        return {}
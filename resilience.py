@@ -0,0 +1,224 @@
+"""
+resilience.py - 重试与熔断
+
+提供:
+- 重试策略 (RetryPolicy)：网络异常、HTTP 429/5xx 等暂时性失败按指数退避 (全抖动) 有限次重试，
+  只读请求才会重试；有副作用的请求只在连接尚未建立 (ConnectTimeout，请求肯定没有发出) 时重试
+- 熔断器 (CircuitBreaker)：连续失败达到阈值后打开，打开期间直接短路不发请求；
+  到时间后半开放行一个探测请求，成功则关闭，失败则重新打开并加倍等待时间
+- 熔断器表 (BreakerBoard)：按账号、按接口 (msg_id) 各一个熔断器；
+  认证失败导致的账号熔断写入状态库，在之后的运行中也不再发请求；暂时性失败导致的熔断只保存在内存中
+"""
+
+import time, random, threading
+import requests
+from latency import HEDGE_SAFE_MSG_IDS
+
+# 可以安全重试的只读请求 (与对冲的范围相同)
+RETRY_SAFE_MSG_IDS = HEDGE_SAFE_MSG_IDS
+# 视为暂时性失败、值得重试的 HTTP 状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class RetryPolicy:
+    """有限次指数退避重试：第 n 次重试前等待 [0, min(max_delay, base_delay × 2^n)] 之间的随机时间"""
+    def __init__(self, retries=2, base_delay=0.5, max_delay=8.0, safe_msg_ids=RETRY_SAFE_MSG_IDS):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.safe_msg_ids = frozenset(safe_msg_ids)
+
+    def should_retry(self, msg_id, attempt, error=None, status=None):
+        """
+        第 attempt 次尝试 (从 0 开始) 失败后是否重试
+
+        Args:
+            error: 请求抛出的异常
+            status: HTTP 状态码 (没有异常时)
+        """
+        if attempt >= self.retries:
+            return False
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        if msg_id not in self.safe_msg_ids:
+            return False
+        if error is not None:
+            return isinstance(error, (requests.RequestException, ValueError))
+        return status in RETRY_STATUS
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class CircuitBreaker:
+    """
+    熔断器：closed (正常) -> open (短路) -> half_open (探测) -> closed / open
+
+    失败由调用方判定后通过 record_failure 登记，连续 failure_threshold 次失败后打开。
+    打开 reset_timeout 秒后 allow() 放行一次探测并重新计时 (探测请求一直没有结果时，下一个周期会再放行一次)；
+    探测失败则等待时间翻倍，最长 max_reset_timeout。
+    tripped 表示当前的打开是由 trip() (如认证失败) 引起的；on_open / on_close 回调用于持久化状态。
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0, max_reset_timeout=3600.0,
+                 on_open=None, on_close=None, clock=time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.on_open = on_open
+        self.on_close = on_close
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.reset_timeout = reset_timeout
+        self.fingerprint = None
+        self.tripped = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = self.clock()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self.opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            was_open = self.state != "closed"
+            self.state = "closed"
+            self.failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self.fingerprint = None
+            self.tripped = False
+        if was_open and self.on_close:
+            self.on_close(self)
+
+    def record_failure(self):
+        """登记一次失败，返回本次是否导致熔断器打开"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self._open(min(self.max_reset_timeout, self.reset_timeout * 2))
+            elif self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open(self.base_reset_timeout)
+            else:
+                return False
+        if self.on_open:
+            self.on_open(self)
+        return True
+
+    def trip(self, reset_timeout=None, fingerprint=None, max_reset_timeout=None):
+        """
+        立即打开 (如账号认证失败)
+
+        探测请求失败时等待时间在上次的基础上翻倍，最长 max_reset_timeout (默认同构造参数)；
+        已经打开时不做改动 (同一账号的并发请求不会把等待时间重复翻倍)，返回 False。
+        """
+        with self._lock:
+            if self.state == "open":
+                return False
+            if reset_timeout is None:
+                reset_timeout = self.base_reset_timeout
+            if self.state == "half_open":
+                cap = max(reset_timeout, max_reset_timeout or self.max_reset_timeout)
+                reset_timeout = max(reset_timeout, min(cap, self.reset_timeout * 2))
+            self._open(reset_timeout)
+            self.fingerprint = fingerprint
+            self.tripped = True
+        if self.on_open:
+            self.on_open(self)
+        return True
+
+    def restore(self, opened_at, reset_timeout, fingerprint=None):
+        """恢复持久化的打开状态"""
+        with self._lock:
+            self.state = "open"
+            self.opened_at = opened_at
+            self.reset_timeout = reset_timeout
+            self.fingerprint = fingerprint
+            self.tripped = True
+
+    def reset(self):
+        """直接关闭 (如账号凭据已被手动更新)"""
+        self.record_success()
+
+    def retry_after(self):
+        """距离下次探测的秒数 (关闭时为 0)"""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def _open(self, reset_timeout):
+        self.state = "open"
+        self.opened_at = self.clock()
+        self.reset_timeout = reset_timeout
+
+class BreakerBoard:
+    """
+    按账号与按接口管理熔断器
+
+    账号熔断器在首次使用时从 store 恢复打开状态；只有 trip() 引起的打开 (认证失败) 写入 store，
+    连续暂时性失败引起的打开只保存在内存中，不会让之后的运行继续跳过该账号。store 为 None 时全部只保存在内存中。
+    """
+    def __init__(self, store=None, failure_threshold=5, reset_timeout=60.0, max_reset_timeout=3600.0):
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._breakers = {}
+        self._persisted = set()
+        self._lock = threading.Lock()
+
+    def _get(self, key, persistent):
+        breaker = self._breakers.get(key)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, self.failure_threshold, self.reset_timeout, self.max_reset_timeout)
+                if persistent and self.store is not None:
+                    saved = self.store.load_breaker(key)
+                    if saved:
+                        breaker.restore(saved["opened_at"], saved["reset_timeout"], saved["fingerprint"])
+                        self._persisted.add(key)
+                    breaker.on_open = self._save
+                    breaker.on_close = self._clear
+                self._breakers[key] = breaker
+        return breaker
+
+    def account(self, key):
+        return self._get(f"account:{key}", persistent=True)
+
+    def endpoint(self, msg_id):
+        return self._get(f"endpoint:{msg_id}", persistent=False)
+
+    def _save(self, breaker):
+        if not breaker.tripped:
+            return
+        try:
+            self.store.save_breaker(breaker.name, breaker.opened_at, breaker.reset_timeout, breaker.fingerprint)
+            self._persisted.add(breaker.name)
+        except Exception as e:
+            print(f"保存熔断状态失败: {e}")
+
+    def _clear(self, breaker):
+        if breaker.name not in self._persisted:
+            return
+        try:
+            self.store.clear_breaker(breaker.name)
+            self._persisted.discard(breaker.name)
+        except Exception as e:
+            print(f"清除熔断状态失败: {e}")
+
+    def snapshot(self):
+        """各熔断器的状态"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.name: {"state": b.state, "failures": b.failures, "retry_after": round(b.retry_after(), 1)}
+                for b in breakers}
@@ -0,0 +1,144 @@
+"""
+sharding.py - 多进程分片运行
+
+提供:
+- 按 roleID 的稳定哈希 (crc32) 把账号分配到固定的工作进程，同一账号的状态与凭据写入只由一个进程负责
+- 启动工作进程、汇总各分片的结果与失败；超时未结束的分片会被终止，不会拖住其他分片
+- 常驻模式下异常退出的分片自动重启，父进程收到 SIGINT/SIGTERM 时通知所有分片退出
+
+工作进程使用 spawn 方式启动 (Windows 与 Linux 行为一致)，入口函数必须是模块级函数。
+"""
+
+import time, zlib, queue, signal, threading, multiprocessing
+
+# 常驻模式下分片异常退出后重启前的等待时间 (秒)
+RESTART_DELAY = 10
+# 终止分片时等待其自行退出 (写回状态) 的时间 (秒)
+TERMINATE_GRACE = 15
+
+def shard_of(key, workers):
+    """键所属的分片编号 (crc32 取模，跨进程、跨运行保持不变)"""
+    return zlib.crc32(str(key).encode('utf-8')) % workers
+
+def account_shard(account, workers):
+    """账号所属的分片：按 roleID 哈希，尚未登录过 (没有 roleID) 的账号按 openID / 备注"""
+    return shard_of(account.get('roleID') or account.get('openID') or account.get('note'), workers)
+
+def select_shard(accounts, shard):
+    """
+    筛选属于某个分片的账号
+
+    Args:
+        accounts: 全部账号
+        shard: (分片编号, 分片总数)，为 None 时返回全部账号
+    """
+    if shard is None:
+        return list(accounts)
+    index, workers = shard
+    return [account for account in accounts if account_shard(account, workers) == index]
+
+def _terminate(signum, frame):
+    raise SystemExit(f"收到信号 {signum}")
+
+def _entry(target, args, index, workers, results):
+    """
+    工作进程入口：运行 target 并把结果放回父进程
+
+    SIGTERM 转为 SystemExit，被父进程终止时 target 的 finally 块 (写回状态等) 仍会执行；
+    常驻模式会另行安装自己的处理函数。
+    """
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        results.put((index, "ok", target(args, (index, workers))))
+    except BaseException as e:
+        results.put((index, "error", f"{type(e).__name__}: {e}"))
+        raise
+
+def _stop(process):
+    """先 SIGTERM 让分片写回状态，超时后强制结束"""
+    if process.is_alive():
+        process.terminate()
+        process.join(TERMINATE_GRACE)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+def run_workers(target, args, workers, timeout=None, restart=False, name="shard"):
+    """
+    在 workers 个进程中运行 target(args, (分片编号, 分片总数))
+
+    Args:
+        target: 模块级函数，返回值需可 pickle
+        args: 传给 target 的参数 (需可 pickle)
+        workers: 分片数
+        timeout: 整体超时 (秒)，到期仍未结束的分片被终止；None 表示不限
+        restart: 分片异常退出时是否重启 (常驻模式)
+
+    Returns:
+        list[tuple]: 按分片编号排序的 (分片编号, 状态, 结果)；状态为 ok / error / timeout / crashed / stopped
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    stop = threading.Event()
+
+    def start(index):
+        process = ctx.Process(target=_entry, args=(target, args, index, workers, results), name=f"{name}-{index}", daemon=False)
+        process.start()
+        return process
+
+    def handle_signal(signum, frame):
+        print(f"\n收到信号 {signum}，正在通知所有分片退出...")
+        stop.set()
+
+    previous = {sig: signal.signal(sig, handle_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+    processes = {index: start(index) for index in range(workers)}
+    outcomes = {}
+    deadline = time.monotonic() + timeout if timeout else None
+    print(f"已启动 {workers} 个分片进程。")
+    try:
+        while len(outcomes) < workers and not stop.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            try:
+                index, status, result = results.get(timeout=0.5)
+                outcomes[index] = (index, status, result)
+                processes[index].join(TERMINATE_GRACE)
+                continue
+            except queue.Empty:
+                pass
+            for index, process in list(processes.items()):
+                if index in outcomes or process.is_alive():
+                    continue
+                # 进程已退出但没有放回结果 (被系统杀死、段错误等)
+                if restart and not stop.is_set():
+                    print(f"分片 {index} 异常退出 (exitcode={process.exitcode})，{RESTART_DELAY} 秒后重启。")
+                    stop.wait(RESTART_DELAY)
+                    if not stop.is_set():
+                        processes[index] = start(index)
+                else:
+                    outcomes[index] = (index, "crashed", f"exitcode={process.exitcode}")
+    finally:
+        for index, process in processes.items():
+            if index not in outcomes:
+                status = "stopped" if stop.is_set() else "timeout"
+                _stop(process)
+                outcomes[index] = (index, status, None)
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    return [outcomes[index] for index in sorted(outcomes)]
+
+def report(outcomes):
+    """打印各分片的结果汇总，返回失败的分片数"""
+    labels = {"ok": "完成", "error": "出错", "timeout": "超时已终止", "crashed": "异常退出", "stopped": "已停止"}
+    failed = 0
+    print("\n" + "=" * 20 + " 分片汇总 " + "=" * 20)
+    for index, status, result in outcomes:
+        if status != "ok":
+            failed += 1
+        detail = ""
+        if isinstance(result, dict):
+            detail = "，".join(f"{k}: {v}" for k, v in result.items())
+        elif result:
+            detail = str(result)
+        print(f"分片 {index}: {labels.get(status, status)}" + (f" ({detail})" if detail else ""))
+    return failed
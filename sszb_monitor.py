@@ -2,15 +2,23 @@
 sszb_monitor.py - 蛇蛇争霸监控脚本
 
 功能:
-- 监控好友在线状态
+- 监控好友在线状态 (好友列表自动翻页)
 - 统计自由战局数
-- 状态变更通知
+- 状态变更通知 (附带好友列表与上一轮的差异)
+- 多账号并发监控：每轮合并所有账号的拉取，在线程池中并发执行 (settings.concurrency)，同一目标每轮只拉取/统计一次
+- 常驻模式 (--daemon): 状态常驻内存，定期写回磁盘
 """
 
-import json, time, os, datetime, sys, io, csv
+import time, os, datetime, sys, threading, argparse, signal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# 导入通用认证模块
-from auth_manager import load_config, save_config, login, get_base_msg, get_common_param, make_request, BASE_URL, HEADERS, FatalAuthError
+# 导入通用认证模块与状态库
+from state_store import get_store
+from metrics import METRICS
+from profiler import PROFILER
+from sharding import account_shard, select_shard, run_workers, report
+from auth_manager import load_config, save_config, login, get_base_msg, get_common_param, get_setting, make_request, BASE_URL, HEADERS, FatalAuthError, AuthRefresher, send_notification, init_metrics
 
 # 添加上一级目录到 sys.path 以便导入 notify.py
 try:
@@ -23,18 +31,6 @@ except:
 # 自由战对应的 gameMode 数值。-1是无模式/离线，"1"是团战，"0"是自由战。
 FREE_BATTLE_MODE_ID = 0
 
-def send_notification(title, content):
-    """通过青龙面板发送通知"""
-    try:
-        # if 'QLAPI' in globals():
-            print(f"正在发送通知: {title}")
-            print(QLAPI.systemNotify({"title": title, "content": content}))
-        # else:
-            # 如果本地环境没有 QLAPI，也可以调用 auth_manager 的 send_notification，或者简单打印
-    except Exception as e:
-        print(f"发送通知失败: {e}")
-        print(f"\n[NOTIFICATION] {title}\n{content}\n")
-
 def check_response(data, account):
     """
     检查接口响应是否存在错误
@@ -67,9 +63,83 @@ def view_target(target_id, account):
                    'teamplayWinningTimes', 'teamplayWinningProbability', 'teamplayBestTimes', 'teamplayBestProbability']
     return {k: data[k] for k in data if k in target_keys}
 
-def get_state_now(account, followType=3, startID=1, endID=20):
+class ProfileCache:
+    """
+    view_target (30002) 结果的 LRU + TTL 缓存，按目标 roleID 共享
+    
+    - 缓存时间不超过 volatile_ttl: 全部字段可信，直接返回
+    - 超过 volatile_ttl 但不超过 stable_ttl: 访客数、金币等易变字段已过期，killCount、段位、奖杯仍可信；
+      开启 stale_while_revalidate 时先返回缓存并在后台刷新，否则同步刷新
+    - 超过 stable_ttl 或调用方要求的 max_age: 同步刷新
     """
-    获取关注列表/好友列表的状态
+    def __init__(self, max_entries=256, volatile_ttl=60, stable_ttl=600, stale_while_revalidate=True):
+        self.max_entries = max_entries
+        self.volatile_ttl = volatile_ttl
+        self.stable_ttl = stable_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._entries = OrderedDict()  # 规范化 roleID -> (获取时间, 详情)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, data):
+        if not data:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key, fetch):
+        try:
+            self._store(key, fetch())
+        except Exception as e:
+            print(f"    后台刷新目标 {key} 详情失败: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, target_id, fetch, max_age=None):
+        """
+        获取目标详情
+        
+        Args:
+            target_id: 目标 roleID
+            fetch: 无参函数，缓存不可用时调用以获取最新详情
+            max_age: 可接受的最大缓存时间 (秒)，默认为 stable_ttl
+        """
+        key = normalize_role_id(target_id)
+        entry = self._lookup(key)
+        limit = self.stable_ttl if max_age is None else max_age
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age <= min(self.volatile_ttl, limit):
+                return entry[1]
+            if age <= limit:
+                if not self.stale_while_revalidate:
+                    data = fetch()
+                    self._store(key, data)
+                    return data or entry[1]
+                with self._lock:
+                    start = key not in self._refreshing
+                    self._refreshing.add(key)
+                if start:
+                    threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+                return entry[1]
+        data = fetch()
+        self._store(key, data)
+        return data
+
+def fetch_friend_page(account, followType=3, startID=1, endID=20):
+    """
+    获取关注列表/好友列表的一页
     
     Args:
         account: 账号配置字典
@@ -78,7 +148,7 @@ def get_state_now(account, followType=3, startID=1, endID=20):
         endID: 结束位置
 
     Returns:
-        dict: 关注列表所有角色
+        dict: 该页的 30014 响应，失败时为空字典
     """
     msg_data = get_base_msg(account)
     msg_data.update({
@@ -93,24 +163,239 @@ def get_state_now(account, followType=3, startID=1, endID=20):
         return {}
     return data
 
-def regroup(data):
-    """重组json数据为以人为单位的列表"""
-    if not data or 'roleID' not in data:
-        return []
-    clean_user_list = []
-    for i in range(len(data['roleID'])):
-        public_info = data['publicInfos'][i]
-        space_status = data['spaceStatus'][i]
-        user_obj = {
-            "id": data['roleID'][i],
-            "name": public_info['name'],
-            "avatar_url": public_info['icon'],
-            "location": public_info['area'],
-            "basic_info": {"sex": int(public_info['sex']), "age": int(public_info['age']), "level": int(public_info['levelInfo']['level'])},
-            "status": {"description": data['statusDesc'][i], "mood": space_status['newMood'], "is_top": bool(data['isTop'][i])}
-        }
-        clean_user_list.append(user_obj)
-    return clean_user_list
+def merge_friend_pages(pages):
+    """
+    合并多页 30014 响应
+    
+    roleID / status / gameMode / statusDesc / publicInfos 等与 roleID 等长的并列数组按页顺序拼接
+    (重复的 roleID 只保留第一次出现)，其余字段取第一页的值。
+    """
+    merged = {}
+    seen = set()
+    for page in pages:
+        ids = page.get('roleID')
+        if not isinstance(ids, list):
+            continue
+        columns = [k for k, v in page.items() if isinstance(v, list) and len(v) == len(ids)]
+        for k, v in page.items():
+            if k not in columns:
+                merged.setdefault(k, v)
+        for k in columns:
+            merged.setdefault(k, [])
+        for i, role_id in enumerate(ids):
+            if str(role_id) in seen:
+                continue
+            seen.add(str(role_id))
+            for k in columns:
+                merged[k].append(page[k][i])
+    return merged
+
+def normalize_role_id(role_id):
+    """统一 roleID 的类型 (配置中是字符串，服务器返回整数)"""
+    text = str(role_id).strip()
+    return str(int(text)) if text.lstrip('-').isdigit() else text
+
+# 快照对比时关注的好友字段
+DIFF_FIELDS = ('status', 'gameMode', 'mood', 'level', 'grade')
+DIFF_FIELD_NAMES = {'status': '状态', 'gameMode': '游戏模式', 'mood': '心情', 'level': '等级', 'grade': '段位'}
+
+# get_state_now 在有页面拉取失败时给合并结果加上的标记
+INCOMPLETE_KEY = '_incomplete'
+
+class FriendSnapshot:
+    """
+    一次 30014 拉取结果的快照
+    
+    构建时为 roleID (统一为字符串) 和名字各建一份哈希索引，之后每个目标的查找都是 O(1)。
+    精简视图、与上一轮的差异和概况文本都按快照缓存，
+    同一轮内多个目标发生变化时只计算一次。
+    """
+    def __init__(self, data):
+        self.data = data or {}
+        self.complete = not self.data.get(INCOMPLETE_KEY)
+        self.by_id = {}
+        self.by_name = {}
+        for i, role_id in enumerate(self.data.get('roleID', [])):
+            self.by_id.setdefault(normalize_role_id(role_id), i)
+        for i, info in enumerate(self.data.get('publicInfos', [])):
+            if isinstance(info, dict) and info.get('name') is not None:
+                self.by_name.setdefault(info['name'], i)
+        self.previous = None  # 上一轮同一账号的精简视图，由 fetch_round 设置
+        self._memo = {}
+        self._memo_lock = threading.RLock()
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def __len__(self):
+        return len(self.data.get('roleID', []))
+
+    def find(self, target_id=None, name=None):
+        """按 ID 查找目标下标，找不到再按名字查找；都找不到返回 -1"""
+        if target_id is not None:
+            idx = self.by_id.get(normalize_role_id(target_id))
+            if idx is not None:
+                return idx
+        if name is not None:
+            return self.by_name.get(name, -1)
+        return -1
+
+    def field(self, key, idx, default=None):
+        """读取并列数组 key 的第 idx 项"""
+        values = self.data.get(key)
+        if not isinstance(values, list) or not 0 <= idx < len(values):
+            return default
+        return values[idx]
+
+    def _memoize(self, name, build):
+        with self._memo_lock:
+            if name not in self._memo:
+                self._memo[name] = build()
+            return self._memo[name]
+
+    def compact(self):
+        """精简视图: 规范化 roleID -> {name, status, gameMode, mood, level, grade}"""
+        def build():
+            result = {}
+            for role_id, i in self.by_id.items():
+                info = self.field('publicInfos', i, {}) or {}
+                space = self.field('spaceStatus', i, {}) or {}
+                result[role_id] = {
+                    "name": info.get('name'),
+                    "status": self.field('status', i),
+                    "gameMode": self.field('gameMode', i),
+                    "mood": space.get('newMood'),
+                    "level": (info.get('levelInfo') or {}).get('level'),
+                    "grade": info.get('grade'),
+                }
+            return result
+        return self._memoize('compact', build)
+
+    def diff(self):
+        """与上一轮快照的差异，没有上一轮时为 None"""
+        if self.previous is None:
+            return None
+        return self._memoize('diff', lambda: diff_snapshots(self.previous, self.compact()))
+
+    def summary(self):
+        """一行概况: 人数、在线数、自由战人数"""
+        def build():
+            compact = self.compact()
+            online = sum(1 for f in compact.values() if (f['status'] or 0) > 0)
+            free_battle = sum(1 for f in compact.values() if f['gameMode'] is not None and int(f['gameMode']) == FREE_BATTLE_MODE_ID)
+            return f"共 {len(compact)} 人，在线 {online} 人，自由战中 {free_battle} 人"
+        return self._memoize('summary', build)
+
+    def diff_text(self):
+        """差异的文本形式"""
+        return self._memoize('diff_text', lambda: format_diff(self.diff(), self.compact(), self.previous))
+
+def diff_snapshots(previous, current):
+    """
+    对比两个精简视图
+    
+    Returns:
+        dict: {"changed": {roleID: {字段: (旧值, 新值)}}, "added": [roleID], "removed": [roleID]}
+    """
+    changed = {}
+    for role_id, friend in current.items():
+        old = previous.get(role_id)
+        if old is None:
+            continue
+        fields = {k: (old.get(k), friend.get(k)) for k in DIFF_FIELDS if old.get(k) != friend.get(k)}
+        if fields:
+            changed[role_id] = fields
+    return {
+        "changed": changed,
+        "added": [role_id for role_id in current if role_id not in previous],
+        "removed": [role_id for role_id in previous if role_id not in current],
+    }
+
+def format_diff(diff, current, previous):
+    """把 diff_snapshots 的结果格式化为通知文本"""
+    if diff is None:
+        return "(首次记录，暂无对比)"
+    lines = []
+    for role_id, fields in diff["changed"].items():
+        changes = "，".join(f"{DIFF_FIELD_NAMES[k]}: {old} → {new}" for k, (old, new) in fields.items())
+        lines.append(f"- {current[role_id]['name']} (ID: {role_id}) {changes}")
+    # 翻页会在找到全部目标后提前结束，出现/消失的好友可能只是未被拉取，只给出人数
+    if diff["added"] or diff["removed"]:
+        lines.append(f"(列表新出现 {len(diff['added'])} 人，未出现 {len(diff['removed'])} 人)")
+    return "\n".join(lines) if lines else "(无变化)"
+
+def targets_found(data, targets):
+    """判断所有目标是否都已出现在列表中 (按 ID 或名字)"""
+    if not targets:
+        return False
+    snapshot = FriendSnapshot(data)
+    return all(snapshot.find(t.get('id'), t.get('name')) != -1 for t in targets)
+
+def get_state_now(account, followType=3, targets=None, page_size=None):
+    """
+    获取完整的关注列表/好友列表状态 (自动翻页)
+    
+    先取第一页；若该页已满，则每轮并发请求后续若干页，直到出现不满的页、
+    达到页数上限，或者 targets 中的目标已全部找到 (onlineFirst 时在线好友排在前面)。
+    
+    Args:
+        account: 账号配置字典
+        followType: 关注类型. 3=好友, 1=关注列表
+        targets: 监控目标列表，全部找到后提前停止翻页
+        page_size: 每页人数，默认取 settings.friend_page_size (20)
+
+    Returns:
+        dict: 合并后的关注列表所有角色；有页面重试后仍拉取失败时带 INCOMPLETE_KEY 标记
+    """
+    page_size = page_size or get_setting("friend_page_size", 20)
+    max_pages = get_setting("friend_max_pages", 20)
+    parallel = max(1, get_setting("friend_page_concurrency", 4))
+
+    first = fetch_friend_page(account, followType, 1, page_size)
+    if not first:
+        return {}
+    pages = {0: first}
+    merged = merge_friend_pages([first])
+    next_page = 1
+    last_full = len(first.get('roleID', [])) >= page_size
+    failed = []
+
+    def fetch(p):
+        return fetch_friend_page(account, followType, p * page_size + 1, (p + 1) * page_size)
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        while last_full and next_page < max_pages and not targets_found(merged, targets):
+            wave = range(next_page, min(next_page + parallel, max_pages))
+            results = list(pool.map(fetch, wave))
+            next_page = wave.stop
+            before = len(merged.get('roleID', []))
+            for p, page in zip(wave, results):
+                if not page:
+                    # 拉取失败的页不等于不满的页，不能据此停止翻页
+                    failed.append(p)
+                    continue
+                pages[p] = page
+                if len(page.get('roleID', [])) < page_size:
+                    last_full = False
+                    break
+            merged = merge_friend_pages([pages[p] for p in sorted(pages)])
+            if any(results) and len(merged.get('roleID', [])) == before:
+                # 没有新角色 (服务器忽略了分页参数)，停止翻页
+                break
+
+    # 失败的页重试一次；仍然失败时标记列表不完整，未出现的目标不能据此判定为离线
+    incomplete = False
+    for p in failed:
+        page = fetch(p)
+        if page:
+            pages[p] = page
+        else:
+            incomplete = True
+            print(f"好友列表第 {p + 1} 页拉取失败，本轮列表不完整。")
+    merged = merge_friend_pages([pages[p] for p in sorted(pages)])
+    if incomplete:
+        merged[INCOMPLETE_KEY] = True
+    return merged
 
 def format_target_detail(detail):
     """格式化目标详情为易读的字符串"""
@@ -132,47 +417,12 @@ def format_target_detail(detail):
     
     return "\n".join(res)
 
-def present(data, file=sys.stdout):
-    """呈现用户列表json数据"""
-    if not data or 'roleID' not in data:
-        return
-
-    def format_time(timestamp):
-        if timestamp == 0:
-            return "无"
-        return time.strftime('%Y-%m-%d', time.localtime(timestamp))
-
-    print("=" * 35, f"用户列表总览 (共 {len(data['roleID'])} 人)", "=" * 35, sep='\n', file=file)
-
-    for i in range(len(data['roleID'])):
-        pid = data['roleID'][i]
-        p_info = data['publicInfos'][i]
-        s_status = data['spaceStatus'][i]
-        status_desc = data['statusDesc'][i]
-        is_top = "[置顶] " if data['isTop'][i] == 1 else ""
-        
-        name = p_info['name'].replace('\r', '').replace('\n', ' ')
-        sex_str = '♀' if p_info['sex'] == '2' else '♂'
-        vip_date = format_time(p_info['vipExpireTime'])
-        
-        mood_content = s_status['newMood'] if s_status['newMood'] else "无心情文本"
-        media_info = ""
-        if s_status.get('info'):
-            media = s_status['info']
-            media_info = f"\n    [媒体] 语音消息 ({media.get('timeSec')}秒): <a href=\"{media.get('uploadUrl')}\">链接</a>"
-        
-        lvl_info = p_info['levelInfo']
-        exp_str = f"(Exp: {lvl_info['curExp']}/{lvl_info['nextExp']})"
-        
-        print(f"NO.{i+1} {is_top}{name} (ID: {pid})", file=file)
-        print(f"    基础: {sex_str} | {p_info['age']}岁 | {p_info['area']} | IP: <a href=\"https://cip.cc/{p_info['ip']}\">{p_info['ip']}</a>", file=file)
-        print(f"    账号: Lv.{lvl_info['level']} {exp_str} | VIP至: {vip_date} | Grade: {p_info['grade']}", file=file)
-        print(f"    状态: {status_desc} | 游戏模式: {data['gameMode'][i]}", file=file)
-        print(f"    动态: {mood_content}{media_info}", file=file)
-        print("-" * 35, file=file)
-
-def save_daily_record(target_data, daily_count, record_file):
-    """保存每日统计记录到CSV"""
+def save_daily_record(target_data, daily_count, target_id, db=None):
+    """
+    保存每日统计记录到状态库 (以目标和日期为主键，当天重复保存时覆盖)
+    
+    导出为旧版 CSV: python state_store.py --export-csv
+    """
     if not target_data:
         return
 
@@ -192,195 +442,529 @@ def save_daily_record(target_data, daily_count, record_file):
     date_str = now.strftime('%Y-%m-%d')
     time_str = now.strftime('%H:%M:%S')
     
-    header = ['Date', 'Time', 'BestOverall', 'KillCount', 'Grade', 'DailyFreeBattleCount']
-    rows = []
-    if os.path.exists(record_file):
-        try:
-            with open(record_file, 'r', newline='', encoding='utf-8-sig') as f:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-        except Exception as e:
-            print(f"读取旧记录失败: {e}")
-
     new_row = {
         'Date': date_str,
         'Time': time_str,
-        'BestOverall': str(best_overall),
-        'KillCount': str(kill_count),
-        'Grade': str(grade),
-        'DailyFreeBattleCount': str(daily_count)
+        'BestOverall': best_overall,
+        'KillCount': kill_count,
+        'Grade': grade,
+        'DailyFreeBattleCount': daily_count
     }
 
-    found = False
-    for i, row in enumerate(rows):
-        if row.get('Date') == date_str:
-            rows[i] = new_row
-            found = True
-            break
-    
-    if not found:
-        rows.append(new_row)
-
     try:
-        with open(record_file, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=header)
-            writer.writeheader()
-            writer.writerows(rows)
+        found = (db or get_store()).upsert_daily_record(target_id, new_row)
         print(f"已{'更新' if found else '保存'}每日记录: {date_str} {time_str}")
     except Exception as e:
         print(f"写入记录失败: {e}")
 
-def load_state(state_file):
-    """读取上一次运行的状态"""
-    if not os.path.exists(state_file):
-        return {
-            "last_status": 0,           # 0: 离线, >0: 在线
-            "last_update_str": "",      # 上次更新时间字符串
-            "daily_count": 0,           # 今日局数
-            "record_date": ""           # 记录局数的那一天日期
-        }
-    try:
-        with open(state_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+def new_state():
+    """新目标的初始状态"""
+    return {
+        "last_status": 0,           # 0: 离线, >0: 在线
+        "last_update_str": "",      # 上次更新时间字符串
+        "daily_count": 0,           # 今日局数
+        "record_date": "",          # 记录局数的那一天日期
+        "last_mode": -1,            # 上次检查时的 gameMode，用于识别进入自由战的那一刻
+        "next_due": 0,              # 下次检查的 Unix 时间戳
+        "offline_backoff": 0        # 当前的离线退避间隔 (秒)
+    }
 
-def save_state(state, state_file):
-    """保存当前状态到文件"""
-    try:
-        with open(state_file, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"保存状态文件失败: {e}")
+# ================= 自适应轮询 =================
+# 目标的 next_due 在此秒数内即视为到期，避免定时任务的触发时间略早于 next_due 而整轮跳过
+SCHEDULE_SLACK = 5
 
-def main():
-    config = load_config()
-    if not config:
-        print("配置文件加载失败，退出。")
-        return
-        
-    accounts = config.get('accounts', [])
+def next_poll_delay(state, status, mode):
+    """
+    按目标当前状态计算距下次检查的秒数，并更新 state 中的离线退避间隔
     
-    if not accounts:
-        print("配置文件中没有找到账号信息。")
-        return
-
-    print(f"开始监控，共 {len(accounts)} 个账号...")
+    对局中按 settings.poll_interval 检查，在线按 poll_online_interval，
+    离线从 poll_offline_min 开始每次翻倍，最多 poll_offline_max；再次上线后退避清零。
+    settings.adaptive_polling 为 false 时返回 0 (每轮都检查)。
+    """
+    if not get_setting("adaptive_polling", True):
+        return 0
+    if int(mode) != -1 or status >= 2:
+        state['offline_backoff'] = 0
+        return get_setting("poll_interval", 30)
+    if status > 0:
+        state['offline_backoff'] = 0
+        return get_setting("poll_online_interval", 60)
+    backoff = state.get('offline_backoff') or 0
+    backoff = min(backoff * 2, get_setting("poll_offline_max", 1800)) if backoff else get_setting("poll_offline_min", 120)
+    state['offline_backoff'] = backoff
+    return backoff
+
+class StateStore:
+    """
+    目标状态的内存缓存
     
+    首次访问某个目标时从 SQLite 状态库读入，之后的读写都在内存中完成，
+    调用 flush 时把改动过的目标在一个事务内批量写回。另外保存每个账号最近一次的好友列表快照
+    和目标详情缓存。
+    """
+    def __init__(self, db=None):
+        self.db = db or get_store()
+        self._states = {}
+        self._dirty = set()
+        self._dirty_snapshots = set()
+        self._lock = threading.Lock()
+        self.snapshots = {}  # 账号 roleID -> 最近一次的 FriendSnapshot
+        self.visibility = {}  # 目标 roleID -> 上次能看到它的账号 roleID 列表
+        self.profiles = ProfileCache(
+            max_entries=get_setting("profile_cache_size", 256),
+            volatile_ttl=get_setting("profile_volatile_ttl", 60),
+            stable_ttl=get_setting("profile_stable_ttl", 600),
+            stale_while_revalidate=get_setting("profile_stale_while_revalidate", True)
+        )
+
+    def get(self, target_id):
+        """获取目标状态 (副本)"""
+        key = str(target_id)
+        with self._lock:
+            if key not in self._states:
+                with PROFILER.span("state_load"):
+                    self._states[key] = self.db.load_target_state(key) or new_state()
+            return dict(self._states[key])
+
+    def put(self, target_id, state):
+        """更新目标状态，等待下次 flush 写盘"""
+        key = str(target_id)
+        with self._lock:
+            self._states[key] = dict(state)
+            self._dirty.add(key)
+
+    def previous_snapshot(self, account_id):
+        """账号上一轮好友列表的精简视图 (内存中没有时从状态库读取)"""
+        snapshot = self.snapshots.get(account_id)
+        if snapshot is not None:
+            return snapshot.compact()
+        with PROFILER.span("state_load"):
+            return self.db.load_friend_snapshot(account_id)
+
+    def set_snapshot(self, account_id, snapshot):
+        """记录账号本轮的好友列表快照，flush 时持久化其精简视图"""
+        with self._lock:
+            self.snapshots[account_id] = snapshot
+            self._dirty_snapshots.add(account_id)
+
+    def flush(self):
+        """把改动过的目标状态和好友列表快照在一个事务内写回状态库"""
+        with self._lock:
+            dirty = [(key, self._states[key]) for key in self._dirty]
+            snapshots = [(key, self.snapshots[key].compact()) for key in self._dirty_snapshots]
+            self._dirty.clear()
+            self._dirty_snapshots.clear()
+        try:
+            with PROFILER.span("state_save"):
+                return self.db.save_target_states(dirty, snapshots)
+        except Exception as e:
+            print(f"保存目标状态失败: {e}")
+            with self._lock:
+                self._dirty.update(key for key, _ in dirty)
+                self._dirty_snapshots.update(key for key, _ in snapshots)
+            return 0
+
+# ================= 跨账号合并 =================
+def collect_targets(accounts):
+    """
+    汇总所有账号的监控目标，同一目标只保留一份
+    
+    Returns:
+        dict: 规范化 roleID -> {"id", "name", "accounts": [关注该目标的账号]}，按配置顺序
+    """
+    registry = {}
     for account in accounts:
         roleID = account.get('roleID')
-        targets = account.get('targets', [])
         note = account.get('note', roleID)
-            
-        print(f"\n>>> 正在使用账号: {note} (ID: {roleID})")
-        
         if not account.get('authKey') or not roleID:
             print(f"账号 {note} 配置缺失 authKey 或 roleID，跳过。")
             continue
-        
+        targets = account.get('targets', [])
         if not targets:
             print(f"账号 {note} 未配置监控目标。")
             continue
-
-        try:
-            # 获取当前好友列表/状态 (make_request 会自动处理 -73 并重连)
-            data = get_state_now(account)
-            if not data:
-                print(f"账号 {note} 获取数据为空，跳过。")
+        for target in targets:
+            if not target.get('id'):
+                print(f"  账号 {note} 的目标配置缺失 ID，跳过。")
                 continue
+            key = normalize_role_id(target['id'])
+            entry = registry.setdefault(key, {"id": target['id'], "name": target.get('name'), "accounts": []})
+            if account not in entry["accounts"]:
+                entry["accounts"].append(account)
+    return registry
 
-            for target in targets:
-                target_id = target.get('id')
-                target_name = target.get('name')
-                
-                if not target_id:
-                    print(f"  目标配置缺失 ID，跳过。")
-                    continue
-                print(f"  > 正在检查目标: {target_name} (ID: {target_id})")
-
-                target_idx = -1
-                if 'roleID' in data and target_id in data['roleID']:
-                    target_idx = data['roleID'].index(target_id)
-                elif 'publicInfos' in data:
-                    for i, info in enumerate(data['publicInfos']):
-                        if info.get('name') == target_name:
-                            target_idx = i
-                            break
-                
-                # 初始化当前状态 (即使不在列表)
-                current_status_code = 0
-                current_mode = -1
-                current_status_desc = "离线(未在列表)"
-                
-                if target_idx != -1:
-                    current_status_code = data['status'][target_idx]
-                    current_mode = data['gameMode'][target_idx]
-                    current_status_desc = data['statusDesc'][target_idx]
-                else:
-                    print(f"    未在列表中找到目标: {target_name}。")
-
-                state_file = os.path.join(os.path.dirname(__file__), f'monitor_state_{target_id}.json')
-                record_file = os.path.join(os.path.dirname(__file__), f'monitor_daily_records_{target_id}.csv')
-
-                try:
-                    is_online_now = current_status_code > 0
-                    state = load_state(state_file)
-                    today_str = datetime.date.today().isoformat()
-                    
-                    if state.get('record_date') != today_str:
-                        state['record_date'] = today_str
-                        state['daily_count'] = 0
-                        print(f"    [{target_name}] 日期变更，计数器已重置。")
-
-                    if int(current_mode) == FREE_BATTLE_MODE_ID:
-                        state['daily_count'] += 1
-                        print(f"    [{target_name}] 检测到正在进行自由战，今日累计第 {state['daily_count']} 局。")
-                    
-                    was_online = state.get('last_status', 0) > 0
-                    title = ""
-                    msg = f"账号: {note}\n目标: {target_name}\n今日已玩自由战: {state['daily_count']} 局\n"
-                    target_detail = {}
-                    
-                    if is_online_now and not was_online:
-                        title = f"你关注的 [{target_name}] 上线了！状态: {current_status_desc}"
-                    elif not is_online_now and was_online:
-                        title = f"你关注的 [{target_name}] 下线了！最终状态: {current_status_desc}"
-                        try:
-                            target_detail = view_target(target_id, account)
-                            save_daily_record(target_detail, state['daily_count'], record_file)
-                        except Exception as e:
-                            print(f"    保存记录时出错: {e}")
-
-                    if title:
-                        if is_online_now:
-                            target_detail = view_target(target_id, account)
-                        
-                        # 格式化详细情况
-                        msg += "\n" + format_target_detail(target_detail) + "\n"
-                        buf = io.StringIO()
-                        present(data, file=buf)
-                        msg += "\n" + "-"*20 + "\n好友列表概况:\n" + buf.getvalue()
-                        
-                        send_notification(title, msg)
-                    
-                    state['last_status'] = current_status_code
-                    state['last_update_str'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    save_state(state, state_file)
-                    print(f"    [{target_name}]检查完毕。状态: {'在线' if is_online_now else '离线'}, 模式: {current_mode}\n{msg}")
-                    
-                except FatalAuthError:
-                    raise FatalAuthError # 继续向上抛出，中断整个账号
-                except Exception as e:
-                    print(f"    处理目标 {target_name} 时发生错误: {e}")
-                    import traceback
-                    traceback.print_exc()
+def plan_fetches(registry, visibility, exclude=()):
+    """
+    选出覆盖全部目标所需的最少好友列表拉取 (贪心集合覆盖)
+    
+    某目标上一轮在哪些账号的好友列表中出现过 (visibility) 就优先由这些账号覆盖，
+    没有记录时退回到配置中关注它的账号。
+    
+    Args:
+        registry: collect_targets 的结果
+        visibility: 规范化 roleID -> 上次能看到该目标的账号 roleID 列表
+        exclude: 不参与本次规划的账号 roleID (已拉取或已失败)
+    
+    Returns:
+        list[(account, [目标条目])]: 需要拉取的账号及其负责的目标
+    """
+    candidates = {}  # 账号 roleID -> (account, 可覆盖的目标 key 集合)
+    order = []
+    for key, entry in registry.items():
+        seen_by = set(visibility.get(key, ()))
+        coverers = [acc for acc in entry["accounts"] if str(acc.get('roleID')) in seen_by] or entry["accounts"]
+        for account in coverers:
+            account_id = str(account.get('roleID'))
+            if account_id in exclude:
+                continue
+            if account_id not in candidates:
+                candidates[account_id] = (account, set())
+                order.append(account_id)
+            candidates[account_id][1].add(key)
+
+    uncovered = {key for _, keys in candidates.values() for key in keys}
+    plan = []
+    while uncovered:
+        # 覆盖最多未覆盖目标的账号优先，相同时按配置顺序
+        best = max(order, key=lambda account_id: len(candidates[account_id][1] & uncovered))
+        account, keys = candidates[best]
+        covered = keys & uncovered
+        if not covered:
+            break
+        plan.append((account, [registry[key] for key in registry if key in covered]))
+        uncovered -= covered
+    return plan
+
+def fetch_snapshot(account, entries):
+    """拉取单个账号的好友列表快照，认证失败或出错时返回 None"""
+    note = account.get('note', account.get('roleID'))
+    print(f"\n>>> 正在使用账号: {note} (ID: {account.get('roleID')})，负责 {len(entries)} 个目标")
+    try:
+        # make_request 会自动处理 -73 并重连
+        data = get_state_now(account, targets=entries)
+    except FatalAuthError:
+        print(f"!!!! 账号 {note} 遭遇严重认证错误，已跳过剩余监控任务 !!!!")
+        return None
+    except Exception as e:
+        print(f"账号 {note} 发生未预期的错误: {e}")
+        return None
+    if not data:
+        print(f"账号 {note} 获取数据为空，跳过。")
+        return None
+    return FriendSnapshot(data)
+
+def fetch_round(plan, store):
+    """并发执行一批拉取 (fetch_snapshot 已按账号隔离异常)，返回 {账号 roleID: FriendSnapshot 或 None}"""
+    with ThreadPoolExecutor(max_workers=max(1, get_setting("concurrency", 8))) as pool:
+        snapshots = list(pool.map(lambda item: fetch_snapshot(*item), plan))
+    results = {}
+    for (account, _), snapshot in zip(plan, snapshots):
+        results[str(account.get('roleID'))] = snapshot
+        if snapshot:
+            snapshot.previous = store.previous_snapshot(str(account.get('roleID')))
+            store.set_snapshot(str(account.get('roleID')), snapshot)
+    return results
+
+def check_target(entry, snapshot, viewer, store):
+    """
+    检查单个目标的状态变化，每轮只执行一次
+    
+    Args:
+        entry: collect_targets 中的目标条目
+        snapshot: 包含该目标的 FriendSnapshot，未找到时为 None
+        viewer: 用于查看详情 (30002) 的账号
+        store: StateStore
+    """
+    target_id = entry['id']
+    target_name = entry['name']
+    notes = ", ".join(str(acc.get('note', acc.get('roleID'))) for acc in entry['accounts'])
+    print(f"  > 正在检查目标: {target_name} (ID: {target_id})")
+
+    with PROFILER.span("lookup"):
+        target_idx = snapshot.find(target_id, target_name) if snapshot else -1
+
+    # 初始化当前状态 (即使不在列表)
+    current_status_code = 0
+    current_mode = -1
+    current_status_desc = "离线(未在列表)"
+    
+    if target_idx != -1:
+        current_status_code = snapshot.field('status', target_idx, 0)
+        current_mode = snapshot.field('gameMode', target_idx, -1)
+        current_status_desc = snapshot.field('statusDesc', target_idx, "")
+    else:
+        print(f"    未在列表中找到目标: {target_name}。")
+
+    is_online_now = current_status_code > 0
+    state = store.get(target_id)
+    today_str = datetime.date.today().isoformat()
+    
+    if state.get('record_date') != today_str:
+        state['record_date'] = today_str
+        state['daily_count'] = 0
+        print(f"    [{target_name}] 日期变更，计数器已重置。")
+
+    # 只在进入自由战的那一次计数，同一局被检查多次不会重复累计
+    if int(current_mode) == FREE_BATTLE_MODE_ID and int(state.get('last_mode', -1)) != FREE_BATTLE_MODE_ID:
+        state['daily_count'] += 1
+        print(f"    [{target_name}] 检测到开始自由战，今日累计第 {state['daily_count']} 局。")
+    
+    was_online = state.get('last_status', 0) > 0
+    title = ""
+    msg = f"账号: {notes}\n目标: {target_name}\n今日已玩自由战: {state['daily_count']} 局\n"
+    target_detail = {}
+    
+    if is_online_now and not was_online:
+        title = f"你关注的 [{target_name}] 上线了！状态: {current_status_desc}"
+    elif not is_online_now and was_online:
+        title = f"你关注的 [{target_name}] 下线了！最终状态: {current_status_desc}"
+        try:
+            # 每日记录需要较新的击杀数等数据，只接受 volatile_ttl 内的缓存
+            target_detail = store.profiles.get(target_id, lambda: view_target(target_id, viewer), max_age=store.profiles.volatile_ttl)
+            with PROFILER.span("record_save"):
+                save_daily_record(target_detail, state['daily_count'], target_id, store.db)
+        except FatalAuthError:
+            raise
+        except Exception as e:
+            print(f"    保存记录时出错: {e}")
 
+    if title:
+        if is_online_now:
+            target_detail = store.profiles.get(target_id, lambda: view_target(target_id, viewer))
+        
+        # 格式化详细情况
+        with PROFILER.span("render"):
+            msg += "\n" + format_target_detail(target_detail) + "\n"
+            if snapshot:
+                # 概况和差异按快照缓存，同一轮多个目标变化时不会重复渲染整个列表
+                msg += "\n" + "-"*20 + f"\n好友列表概况: {snapshot.summary()}\n本轮变化:\n{snapshot.diff_text()}\n"
+        
+        send_notification(title, msg)
+    
+    state['last_status'] = current_status_code
+    state['last_mode'] = int(current_mode)
+    state['next_due'] = time.time() + next_poll_delay(state, current_status_code, current_mode)
+    state['last_update_str'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    store.put(target_id, state)
+    print(f"    [{target_name}]检查完毕。状态: {'在线' if is_online_now else '离线'}, 模式: {current_mode}\n{msg}")
+
+def shard_targets(registry, shard):
+    """
+    只保留归属于本分片的目标
+    
+    目标归属于配置中第一个关注它的账号所在的分片，每个目标只由一个分片检查；
+    条目中的账号也只保留本分片的账号 (其他分片的账号不在本进程拉取)。
+    """
+    if shard is None:
+        return registry
+    index, workers = shard
+    owned = {}
+    for key, entry in registry.items():
+        if account_shard(entry['accounts'][0], workers) == index:
+            owned[key] = dict(entry, accounts=[acc for acc in entry['accounts'] if account_shard(acc, workers) == index])
+    return owned
+
+def run_cycle(accounts, store, shard=None):
+    """
+    对所有目标执行一轮检查
+    
+    只为已到期 (next_due) 的目标按 plan_fetches 选出最少的好友列表拉取；没有在任何已拉取列表中找到的
+    到期目标，再用其他关注它的账号补拉一次。未到期但出现在已拉取列表中的目标顺带检查 (不增加请求)。
+    之后每个目标只处理一次，结果通知所有关注它的账号。
+    
+    Args:
+        accounts: 全部账号
+        store: StateStore
+        shard: 多进程运行时的 (分片编号, 分片总数)，只检查归属于本分片的目标
+    
+    Returns:
+        float | None: 所有目标中最早的下次检查时间，没有目标时为 None
+    """
+    with PROFILER.span("lookup"):
+        registry = shard_targets(collect_targets(accounts), shard)
+    if not registry:
+        return None
+
+    now = time.time()
+    due = {key: entry for key, entry in registry.items()
+           if store.get(entry['id']).get('next_due', 0) <= now + SCHEDULE_SLACK}
+    if not due:
+        print(f"\n{len(registry)} 个目标均未到检查时间，本轮跳过。")
+        return min(store.get(entry['id']).get('next_due', 0) for entry in registry.values())
+
+    fetched = {}
+    with PROFILER.span("lookup"):
+        plan = plan_fetches(due, store.visibility)
+    while plan:
+        fetched.update(fetch_round(plan, store))
+        with PROFILER.span("lookup"):
+            missing = {key: entry for key, entry in due.items()
+                       if not any(snap and snap.find(entry['id'], entry['name']) != -1 for snap in fetched.values())}
+            plan = plan_fetches(missing, {}, exclude=set(fetched))
+    with PROFILER.span("lookup"):
+        targets = {key: entry for key, entry in registry.items()
+                   if key in due or any(snap and snap.find(entry['id'], entry['name']) != -1 for snap in fetched.values())}
+    print(f"\n本轮拉取 {len(fetched)} 次好友列表，检查 {len(targets)}/{len(registry)} 个目标 (到期 {len(due)} 个)。")
+
+    def process(item):
+        key, entry = item
+        snapshot, viewer = None, None
+        seen_by = []
+        for account in entry['accounts']:
+            snap = fetched.get(str(account.get('roleID')))
+            if snap and snap.find(entry['id'], entry['name']) != -1:
+                seen_by.append(str(account.get('roleID')))
+                if snapshot is None:
+                    snapshot, viewer = snap, account
+        if seen_by:
+            store.visibility[key] = seen_by
+        if viewer is None:
+            # 列表有页面拉取失败时，目标可能在缺失的页中，不能判定为离线
+            snaps = [fetched.get(str(acc.get('roleID'))) for acc in entry['accounts']]
+            snaps = [snap for snap in snaps if snap]
+            if snaps and not any(snap.complete for snap in snaps):
+                print(f"  目标 {entry['name']} 不在已拉取的列表中，但列表不完整，保持上一轮状态。")
+                return
+            # 所有关注账号都没看到该目标: 用成功拉取过的账号查看详情
+            viewer = next((acc for acc in entry['accounts'] if fetched.get(str(acc.get('roleID')))), None)
+            if viewer is None:
+                print(f"  目标 {entry['name']} 的关注账号均拉取失败，本轮跳过。")
+                return
+        try:
+            check_target(entry, snapshot, viewer, store)
         except FatalAuthError:
-            print(f"!!!! 账号 {note} 遭遇严重认证错误，已跳过剩余监控任务 !!!!")
-            continue
+            print(f"    账号 {viewer.get('note')} 认证失败，目标 {entry['name']} 本轮跳过。")
         except Exception as e:
-            print(f"账号 {note} 发生未预期的错误: {e}")
-            continue
+            print(f"    处理目标 {entry['name']} 时发生错误: {e}")
+            import traceback
+            traceback.print_exc()
+
+    with ThreadPoolExecutor(max_workers=max(1, get_setting("concurrency", 8))) as pool:
+        list(pool.map(process, targets.items()))
+    return min(store.get(entry['id']).get('next_due', 0) for entry in registry.values())
+
+def run_daemon(accounts, store, interval, flush_interval, shard=None):
+    """
+    常驻轮询：配置、连接池和目标状态都保存在内存中
+    
+    Args:
+        accounts: 账号列表
+        store: StateStore
+        interval: 两轮检查之间的最长间隔 (秒)；有目标更早到期时提前开始下一轮，未到期的目标不会发请求
+        flush_interval: 状态写回状态库的间隔 (秒)，0 表示每轮写回；退出时也会写回
+        shard: 多进程运行时的 (分片编号, 分片总数)
+    """
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        print(f"\n收到信号 {signum}，正在退出...")
+        stop.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, handle_signal)
+
+    print(f"进入常驻模式，轮询间隔 {interval} 秒，状态写盘间隔 {flush_interval} 秒。")
+    last_flush = time.monotonic()
+    # 后台在 authKey 预计失效前刷新，轮询请求基本不会再走 -73 慢路径
+    refresher = AuthRefresher(select_shard(accounts, shard)).start()
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            with METRICS.cycle("monitor"):
+                next_due = run_cycle(accounts, store, shard)
+            METRICS.write_files()
+
+            # 默认每轮写一次 (一个事务)；flush_interval > 0 时按间隔合并写入
+            if time.monotonic() - last_flush >= flush_interval:
+                store.flush()
+                last_flush = time.monotonic()
+
+            wait = interval - (time.monotonic() - started)
+            if next_due is not None:
+                wait = min(wait, next_due - time.time())
+            stop.wait(max(0, wait))
+    finally:
+        refresher.stop()
+        count = store.flush()
+        print(f"已写回 {count} 个目标状态。")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="蛇蛇争霸好友状态监控")
+    parser.add_argument("--daemon", action="store_true", help="常驻运行，按间隔循环检查")
+    parser.add_argument("--interval", type=float, default=None, help="常驻模式的轮询间隔 (秒)，默认取 settings.poll_interval")
+    parser.add_argument("--flush-interval", type=float, default=None, help="常驻模式的状态写盘间隔 (秒)，默认取 settings.state_flush_interval")
+    parser.add_argument("--profile", nargs="?", const="spans", default=None, metavar="OPTIONS",
+                        help="开启性能剖析: spans (默认) / cprofile / tracemalloc / all，可用逗号组合；也可设置环境变量 SSZB_PROFILE")
+    parser.add_argument("--workers", type=int, default=None, help="按 roleID 把账号分到多个进程运行，默认取 settings.workers (1 为单进程)")
+    parser.add_argument("--worker-timeout", type=float, default=None, help="单次运行时分片的超时时间 (秒)，默认取 settings.worker_timeout")
+    return parser.parse_args(argv)
+
+def run_shard(args, shard):
+    """分片进程入口：只处理归属于本分片的账号与目标，返回结果摘要"""
+    config = load_config()
+    accounts = config.get('accounts', []) if config else []
+    own = select_shard(accounts, shard)
+    print(f"[分片 {shard[0]}] 负责 {len(own)} 个账号。")
+    started = time.monotonic()
+    store = StateStore()
+    metrics = init_metrics(shard=shard[0])
+    PROFILER.start(f"monitor_shard{shard[0]}", args.profile)
+    try:
+        if args.daemon:
+            interval = args.interval if args.interval is not None else get_setting("poll_interval", 30)
+            flush_interval = args.flush_interval if args.flush_interval is not None else get_setting("state_flush_interval", 0)
+            run_daemon(accounts, store, interval, flush_interval, shard)
+        else:
+            try:
+                with metrics.cycle("monitor"):
+                    run_cycle(accounts, store, shard)
+            finally:
+                # 超时被终止时也写回已处理目标的状态，避免下次运行重复通知
+                store.flush()
+            metrics.write_files()
+    finally:
+        PROFILER.finish()
+    return {"账号": len(own), "用时": f"{time.monotonic() - started:.1f}秒"}
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config()
+    if not config:
+        print("配置文件加载失败，退出。")
+        return
+        
+    accounts = config.get('accounts', [])
+    
+    if not accounts:
+        print("配置文件中没有找到账号信息。")
+        return
+
+    print(f"开始监控，共 {len(accounts)} 个账号...")
+    workers = args.workers if args.workers is not None else get_setting("workers", 1)
+    if workers > 1:
+        # 常驻模式不设超时，分片异常退出时自动重启
+        timeout = None if args.daemon else (args.worker_timeout or get_setting("worker_timeout", 600))
+        report(run_workers(run_shard, args, workers, timeout=timeout, restart=args.daemon, name="monitor"))
+        return
+
+    PROFILER.start("monitor", args.profile)
+    try:
+        store = StateStore()
+        metrics = init_metrics()
+
+        if args.daemon:
+            interval = args.interval if args.interval is not None else get_setting("poll_interval", 30)
+            flush_interval = args.flush_interval if args.flush_interval is not None else get_setting("state_flush_interval", 0)
+            run_daemon(accounts, store, interval, flush_interval)
+            return
+
+        # 各账号并发检查，互不阻塞
+        with metrics.cycle("monitor"):
+            run_cycle(accounts, store)
+            store.flush()
+        metrics.write_files()
+    finally:
+        PROFILER.finish()
 
     print("\n所有账号监控任务执行完毕。")
 
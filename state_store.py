@@ -0,0 +1,414 @@
+"""
+state_store.py - 状态存储模块
+
+提供:
+- 基于 SQLite (WAL 模式) 的目标状态存储, 每轮检查在一个事务内批量写入
+- 各账号上一轮好友列表的精简快照 (用于对比变化)
+- 账号认证失败的静默标记 (取代 .auth_failed_mark_{roleID} 文件)
+- 账号熔断器的打开状态 (跨进程、跨运行保留)
+- authKey 的签发时间与观测到的有效期
+- 每日统计记录, 以 (目标, 日期) 为主键, 当天记录 O(1) 更新, 可导出为 CSV
+- 旧版 monitor_state_{id}.json / .auth_failed_mark_{roleID} / 每日记录 CSV 的一次性迁移
+"""
+
+import sqlite3, json, os, glob, datetime, threading, argparse, csv
+
+# ================= 配置区域 =================
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(DATA_DIR, 'sszb_state.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS target_state (
+    target_id  TEXT PRIMARY KEY,
+    state      TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS friend_snapshot (
+    account_id TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS auth_failure (
+    role_id    TEXT PRIMARY KEY,
+    note       TEXT,
+    failed_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS circuit_breaker (
+    breaker_key   TEXT PRIMARY KEY,
+    opened_at     REAL NOT NULL,
+    reset_timeout REAL NOT NULL,
+    fingerprint   TEXT
+);
+CREATE TABLE IF NOT EXISTS auth_meta (
+    account_key TEXT PRIMARY KEY,
+    issued_at   REAL,
+    clock_skew  REAL,
+    lifetimes   TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS daily_record (
+    target_id    TEXT NOT NULL,
+    date         TEXT NOT NULL,
+    time         TEXT NOT NULL,
+    best_overall INTEGER,
+    kill_count   INTEGER,
+    grade        INTEGER,
+    daily_count  INTEGER,
+    PRIMARY KEY (target_id, date)
+);
+"""
+
+# 每日记录 CSV 的表头 (与旧版 monitor_daily_records_{id}.csv 一致)
+DAILY_RECORD_HEADER = ['Date', 'Time', 'BestOverall', 'KillCount', 'Grade', 'DailyFreeBattleCount']
+_DAILY_RECORD_COLUMNS = ['date', 'time', 'best_overall', 'kill_count', 'grade', 'daily_count']
+
+# 全局存储实例 (惰性创建)
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+class SqliteStore:
+    """
+    单文件 SQLite 状态库
+
+    WAL 模式下监控与每日任务两个进程可以同时读写；连接在线程间共享，由锁串行化。
+    """
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 目标状态 ----------
+    def load_target_state(self, target_id):
+        """读取目标状态，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM target_state WHERE target_id = ?", (str(target_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_target_states(self, items, snapshots=()):
+        """
+        在一个事务中批量写入目标状态 (以及好友列表快照)
+
+        Args:
+            items: 可迭代的 (target_id, state 字典)
+            snapshots: 可迭代的 (账号 roleID, 精简快照字典)
+
+        Returns:
+            int: 写入的目标状态条数
+        """
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = [(str(target_id), json.dumps(state, ensure_ascii=False), now) for target_id, state in items]
+        snapshot_rows = [(str(account_id), json.dumps(data, ensure_ascii=False), now) for account_id, data in snapshots]
+        if not rows and not snapshot_rows:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO target_state (target_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(target_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    rows)
+                self._conn.executemany(
+                    "INSERT INTO friend_snapshot (account_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(account_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    snapshot_rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def load_friend_snapshot(self, account_id):
+        """读取账号上一次保存的好友列表精简快照，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM friend_snapshot WHERE account_id = ?", (str(account_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ---------- 认证失败标记 ----------
+    def is_auth_failed(self, role_id):
+        """账号是否处于认证失败静默状态"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM auth_failure WHERE role_id = ?", (str(role_id),)).fetchone()
+        return row is not None
+
+    def mark_auth_failed(self, role_id, note="", failed_at=None):
+        """记录认证失败 (已存在时保留最早的失败时间)"""
+        failed_at = failed_at or datetime.datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO auth_failure (role_id, note, failed_at) VALUES (?, ?, ?)",
+                (str(role_id), note, failed_at))
+
+    def clear_auth_failed(self, role_id):
+        """清除认证失败标记，返回是否确实存在过标记"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM auth_failure WHERE role_id = ?", (str(role_id),))
+        return cur.rowcount > 0
+
+    # ---------- 熔断器 ----------
+    def load_breaker(self, breaker_key):
+        """
+        读取处于打开状态的熔断器
+
+        Returns:
+            dict | None: {"opened_at": 时间戳, "reset_timeout": 秒, "fingerprint": 打开时的凭据指纹}
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT opened_at, reset_timeout, fingerprint FROM circuit_breaker WHERE breaker_key = ?",
+                                     (str(breaker_key),)).fetchone()
+        if not row:
+            return None
+        return {"opened_at": row[0], "reset_timeout": row[1], "fingerprint": row[2]}
+
+    def save_breaker(self, breaker_key, opened_at, reset_timeout, fingerprint=None):
+        """记录熔断器打开 (覆盖旧记录)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO circuit_breaker (breaker_key, opened_at, reset_timeout, fingerprint) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(breaker_key) DO UPDATE SET opened_at = excluded.opened_at, "
+                "reset_timeout = excluded.reset_timeout, fingerprint = excluded.fingerprint",
+                (str(breaker_key), opened_at, reset_timeout, fingerprint))
+
+    def clear_breaker(self, breaker_key):
+        """熔断器关闭后删除记录"""
+        with self._lock:
+            self._conn.execute("DELETE FROM circuit_breaker WHERE breaker_key = ?", (str(breaker_key),))
+
+    # ---------- 凭据有效期 ----------
+    def load_auth_meta(self, account_key):
+        """
+        读取账号凭据的有效期记录
+
+        Returns:
+            dict: {"issued_at": 服务器时间戳, "clock_skew": 服务器时间 - 本地时间, "lifetimes": [秒, ...]}
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT issued_at, clock_skew, lifetimes FROM auth_meta WHERE account_key = ?",
+                                     (str(account_key),)).fetchone()
+        if not row:
+            return {"issued_at": None, "clock_skew": 0.0, "lifetimes": []}
+        return {"issued_at": row[0], "clock_skew": row[1] or 0.0, "lifetimes": json.loads(row[2])}
+
+    def save_auth_meta(self, account_key, meta):
+        """写入账号凭据的有效期记录"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO auth_meta (account_key, issued_at, clock_skew, lifetimes) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(account_key) DO UPDATE SET issued_at = excluded.issued_at, "
+                "clock_skew = excluded.clock_skew, lifetimes = excluded.lifetimes",
+                (str(account_key), meta.get("issued_at"), meta.get("clock_skew", 0.0), json.dumps(meta.get("lifetimes", []))))
+
+    # ---------- 每日记录 ----------
+    def upsert_daily_record(self, target_id, record):
+        """
+        写入目标当天的统计记录 (同一天重复写入时覆盖)
+
+        Args:
+            target_id: 目标 roleID
+            record: 以 DAILY_RECORD_HEADER 为键的字典
+
+        Returns:
+            bool: True 表示覆盖了已有记录，False 表示新增
+        """
+        values = [record.get(h) for h in DAILY_RECORD_HEADER]
+        with self._lock:
+            found = self._conn.execute("SELECT 1 FROM daily_record WHERE target_id = ? AND date = ?",
+                                       (str(target_id), values[0])).fetchone() is not None
+            self._conn.execute(
+                "INSERT INTO daily_record (target_id, date, time, best_overall, kill_count, grade, daily_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(target_id, date) DO UPDATE SET "
+                "time = excluded.time, best_overall = excluded.best_overall, kill_count = excluded.kill_count, "
+                "grade = excluded.grade, daily_count = excluded.daily_count",
+                [str(target_id)] + values)
+        return found
+
+    def insert_daily_records(self, rows):
+        """
+        在一个事务中批量插入每日记录，已存在的 (目标, 日期) 保持不变
+
+        Args:
+            rows: 可迭代的 [target_id, Date, Time, BestOverall, KillCount, Grade, DailyFreeBattleCount]
+
+        Returns:
+            int: 实际插入的条数
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.executemany(
+                    "INSERT OR IGNORE INTO daily_record (target_id, date, time, best_overall, kill_count, grade, daily_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount
+
+    def daily_records(self, target_id=None, start=None, end=None):
+        """
+        按日期升序查询每日记录
+
+        Args:
+            target_id: 只查询该目标，None 表示全部目标
+            start, end: 日期范围 (含)，格式 YYYY-MM-DD
+
+        Returns:
+            list[tuple]: (target_id, date, time, best_overall, kill_count, grade, daily_count)
+        """
+        sql = "SELECT target_id, " + ", ".join(_DAILY_RECORD_COLUMNS) + " FROM daily_record WHERE 1 = 1"
+        params = []
+        if target_id is not None:
+            sql += " AND target_id = ?"
+            params.append(str(target_id))
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND date <= ?"
+            params.append(end)
+        with self._lock:
+            return self._conn.execute(sql + " ORDER BY target_id, date", params).fetchall()
+
+    def daily_record_values(self, start=None, end=None):
+        """
+        全部目标的每日记录数值列 (供 analytics 构建列式数组)，不保证顺序
+
+        Returns:
+            list[tuple]: (target_id, date, best_overall, kill_count, grade, daily_count)，
+                         数值列为 REAL，空值或无法解析时为 None
+        """
+        numeric = ", ".join(f"CAST(NULLIF(TRIM({col}), '') AS REAL)" for col in _DAILY_RECORD_COLUMNS[2:])
+        sql = f"SELECT target_id, date, {numeric} FROM daily_record WHERE 1 = 1"
+        params = []
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND date <= ?"
+            params.append(end)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def daily_record_baseline(self, before):
+        """
+        各目标在 before 之前最后一天的记录 (供 analytics 计算窗口第一天的增量)
+
+        Returns:
+            list[tuple]: 与 daily_record_values 相同的列
+        """
+        numeric = ", ".join(f"CAST(NULLIF(TRIM(d.{col}), '') AS REAL)" for col in _DAILY_RECORD_COLUMNS[2:])
+        sql = (f"SELECT d.target_id, d.date, {numeric} FROM daily_record d "
+               "JOIN (SELECT target_id, MAX(date) AS date FROM daily_record WHERE date < ? GROUP BY target_id) last "
+               "ON d.target_id = last.target_id AND d.date = last.date")
+        with self._lock:
+            return self._conn.execute(sql, (before,)).fetchall()
+
+    def export_daily_csv(self, target_id, path):
+        """把目标的全部每日记录导出为旧版格式的 CSV，返回行数"""
+        rows = self.daily_records(target_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(DAILY_RECORD_HEADER)
+            writer.writerows(row[1:] for row in rows)
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    def daily_record_targets(self):
+        """有每日记录的全部目标 ID"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT target_id FROM daily_record ORDER BY target_id")]
+
+def get_store():
+    """获取全局状态库"""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = SqliteStore()
+        return _STORE
+
+# ================= 旧文件迁移 =================
+def migrate_legacy_files(store, directory=DATA_DIR):
+    """
+    把旧版状态文件导入状态库，导入成功的文件重命名为 *.migrated
+
+    Returns:
+        tuple: (导入的目标状态数, 导入的认证失败标记数)
+    """
+    states = []
+    state_files = []
+    for path in glob.glob(os.path.join(directory, 'monitor_state_*.json')):
+        target_id = os.path.basename(path)[len('monitor_state_'):-len('.json')]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                states.append((target_id, json.load(f)))
+            state_files.append(path)
+        except Exception as e:
+            print(f"读取 {path} 失败，跳过: {e}")
+    store.save_target_states(states)
+
+    marks = 0
+    mark_files = []
+    for path in glob.glob(os.path.join(directory, '.auth_failed_mark_*')):
+        if path.endswith('.migrated'):
+            continue
+        role_id = os.path.basename(path)[len('.auth_failed_mark_'):]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            failed_at = content.split(':', 1)[1].strip() if ':' in content else None
+            store.mark_auth_failed(role_id, failed_at=failed_at)
+            mark_files.append(path)
+            marks += 1
+        except Exception as e:
+            print(f"读取 {path} 失败，跳过: {e}")
+
+    for path in state_files + mark_files:
+        os.replace(path, path + '.migrated')
+    return len(states), marks
+
+def import_daily_csv(store, directory=DATA_DIR):
+    """
+    导入旧版 monitor_daily_records_{id}.csv (库中已有的同日记录不会被覆盖)
+
+    Returns:
+        int: 新导入的行数
+    """
+    count = 0
+    for path in glob.glob(os.path.join(directory, 'monitor_daily_records_*.csv')):
+        target_id = os.path.basename(path)[len('monitor_daily_records_'):-len('.csv')]
+        try:
+            with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+                rows = [[target_id] + [row.get(h) for h in DAILY_RECORD_HEADER] for row in csv.DictReader(f)]
+        except Exception as e:
+            print(f"读取 {path} 失败，跳过: {e}")
+            continue
+        count += store.insert_daily_records(rows)
+    return count
+
+def export_daily_csv(store, directory=DATA_DIR, target_id=None):
+    """按目标导出 monitor_daily_records_{id}.csv，返回导出的文件数"""
+    targets = [str(target_id)] if target_id is not None else store.daily_record_targets()
+    for tid in targets:
+        store.export_daily_csv(tid, os.path.join(directory, f'monitor_daily_records_{tid}.csv'))
+    return len(targets)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="蛇蛇争霸状态库工具")
+    parser.add_argument("--migrate", action="store_true", help="导入旧版 monitor_state_*.json、.auth_failed_mark_* 和每日记录 CSV")
+    parser.add_argument("--export-csv", nargs="?", const="", metavar="TARGET_ID", help="导出每日记录 CSV (不指定目标则导出全部)")
+    args = parser.parse_args()
+    if args.migrate:
+        state_count, mark_count = migrate_legacy_files(get_store())
+        record_count = import_daily_csv(get_store())
+        print(f"迁移完成: {state_count} 个目标状态, {mark_count} 个认证失败标记, {record_count} 条每日记录。")
+    elif args.export_csv is not None:
+        file_count = export_daily_csv(get_store(), target_id=args.export_csv or None)
+        print(f"已导出 {file_count} 个每日记录 CSV。")
+    else:
+        parser.print_help()